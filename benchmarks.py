@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+from __future__ import division
+
+"""
+Benchmarks for the parts of puzzle generation that don't depend on Wordnik.
+
+The puzzles are generated with RandomWordnik, a stand-in for the Wordnik client
+that makes up a word for every search instead of making API calls, so the
+numbers measure this program rather than the network.
+
+    python benchmarks.py export --count 20000
+    python benchmarks.py open_spans
+    python benchmarks.py regions --processes 4
+"""
+
+
+import itertools
+import os
+from optparse import OptionParser
+import random
+import shutil
+import string
+import sys
+import tempfile
+import time
+
+import crosswordnik
+from crosswordnik import CrosswordPuzzle, Grid
+import export
+import regions
+
+
+class RandomWordnik(object):
+    """Stand-in for wordnik.Wordnik that invents words matching each query."""
+
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+        self.timeout = None
+
+    def _letter(self):
+        return self.random.choice(string.ascii_lowercase)
+
+    def word_of_the_day(self):
+        return {'wordstring': ''.join(self._letter() for i in range(5))}
+
+    def word_search(self, query, **kwargs):
+        word = ''.join(self._letter() if c == '?' else c for c in query)
+        return [{'wordstring': word, 'count': 1}]
+
+    def definitions(self, word, **kwargs):
+        return [{'text': 'A made up word spelled %s.' % word}]
+
+
+def make_offline_puzzle(rows, columns, num_words, seed=None):
+    """Return a populated puzzle whose words come from RandomWordnik."""
+    puzzle = CrosswordPuzzle(rows, columns, wordnik=RandomWordnik(seed))
+    puzzle.populate_puzzle(num_words)
+    return puzzle
+
+
+def _report(name, count, seconds):
+    print '%s: %d in %.2fs (%.0f per second)' % (name, count, seconds,
+                                                  count / seconds)
+
+
+def bench_export(count, rows=15, columns=15):
+    """Time exporting `count` puzzles in each format to a directory and a zip."""
+    puzzle = make_offline_puzzle(rows, columns, 40, seed=0)
+    directory = tempfile.mkdtemp()
+    try:
+        for format_ in sorted(export.FORMATS):
+            for target in ('files', 'archive.zip'):
+                path = '%s/%s-%s' % (directory, format_, target)
+                start = time.time()
+                export.export_puzzles(itertools.repeat(puzzle, count), path,
+                                      format_)
+                _report('%s to %s' % (format_, target), count,
+                        time.time() - start)
+    finally:
+        shutil.rmtree(directory)
+
+
+def random_grid(rows, columns, seed=None):
+    """Return a grid with a quarter of the squares holding letters."""
+    rand = random.Random(seed)
+    grid = Grid(rows, columns)
+    for sq in list(grid):
+        x = rand.random()
+        if x < 0.25:
+            grid.set_letter(sq.m, sq.n, 'a')
+        elif x < 0.35:
+            grid.blackout_square(sq.m, sq.n)
+    return grid
+
+
+def bench_open_spans(sizes=(5, 10, 15, 21, 30, 40, 50), repeat=3):
+    """Time the pure Python and NumPy versions of Grid.open_spans."""
+    if crosswordnik.np is None:
+        print 'NumPy is not installed.'
+        return
+    print '%5s %8s %10s %10s %8s' % ('size', 'spans', 'python', 'numpy',
+                                     'speedup')
+    for size in sizes:
+        grid = random_grid(size, size, seed=size)
+        times = {}
+        for name, open_spans in (('python', grid._open_spans_python),
+                                 ('numpy', grid._open_spans_numpy)):
+            start = time.time()
+            for i in range(repeat):
+                spans = list(open_spans())
+            times[name] = (time.time() - start) / repeat
+        print '%5s %8d %9.4fs %9.4fs %7.1fx' % (
+            '%dx%d' % (size, size), len(spans), times['python'],
+            times['numpy'], times['python'] / times['numpy'])
+
+
+def bench_regions(sizes=(15, 21, 30, 50, 75, 100), processes=None,
+                  max_whole_size=30):
+    """Time region by region generation against grid area.
+
+    Grids up to `max_whole_size` are also generated whole, with as many words
+    as the regions placed, for comparison.
+    """
+    print '%7s %6s %6s %9s %11s %9s' % ('size', 'area', 'words', 'regions',
+                                        'ms/square', 'whole')
+    for size in sizes:
+        start = time.time()
+        puzzle = regions.make_large_puzzle(size, size, processes=processes,
+                                           wordnik=RandomWordnik(size))
+        seconds = time.time() - start
+        whole = '-'
+        if size <= max_whole_size:
+            start = time.time()
+            make_offline_puzzle(size, size, len(puzzle.clues), seed=size)
+            whole = '%.2fs' % (time.time() - start)
+        print '%7s %6d %6d %8.2fs %11.3f %9s' % (
+            '%dx%d' % (size, size), size * size, len(puzzle.clues), seconds,
+            1000 * seconds / (size * size), whole)
+
+
+def main(args):
+    parser = OptionParser(usage='%prog BENCHMARK [options]')
+    parser.add_option('-c', '--count', dest='count', type='int', default=20000,
+                      help='number of puzzles to export')
+    parser.add_option('-p', '--processes', dest='processes', type='int',
+                      help='number of worker processes for regions')
+    options, args = parser.parse_args(args)
+
+    benchmarks = {
+        'export': lambda: bench_export(options.count),
+        'open_spans': bench_open_spans,
+        'regions': lambda: bench_regions(processes=options.processes),
+    }
+    if len(args) != 1 or args[0] not in benchmarks:
+        parser.error('Choose a benchmark: %s' % ', '.join(sorted(benchmarks)))
+
+    # The puzzle generator reports every word it places on stderr.
+    sys.stderr = open(os.devnull, 'w')
+    benchmarks[args[0]]()
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -18,17 +18,35 @@ the grid and clues to the user and a way to get the user's input.
 >>>     # SHOW GRID AND CLUES TO USER
 >>>     m, n, letter = # GET INPUT FROM USER
 >>>     puzzle.enter_from_user(m, n, letter)
+
+Several players can solve the same puzzle at once, each with their own
+session.PlayerSession sharing the puzzle's solution.
+>>> session = puzzle.new_session()
+>>> session.enter(m, n, letter)
 """
 
 
 from pprint import pprint
 import random
+import socket
 import sys
+import time
 
+from difficulty import check_difficulty, search_kwargs
+from lexicon import ALL_LETTERS, letter_mask, mask_letters
+from session import PlayerSession, Solution
 from wordnik import Wordnik
+from wordnikcache import CacheClient
 
 import config
 
+# NumPy is optional. When it's installed Grid.open_spans uses a vectorized
+# version of the span checks.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class Square(object):
     """Representation for a square on a grid."""
@@ -37,9 +55,13 @@ class Square(object):
         self.m = m
         self.n = n
         self._letter = None
-        self.user_entry = None
         self.id_ = None
         self._blacked_out = False
+        # Masks (see lexicon.letter_mask) of the letters that keep the across
+        # and down runs through the square possible words. Kept up to date by
+        # Grid when it has a lexicon.
+        self.across_check = ALL_LETTERS
+        self.down_check = ALL_LETTERS
 
     @property
     def letter(self):
@@ -67,6 +89,16 @@ class Square(object):
             raise ValueError('Cannot black out a square containing a letter.')
         self._blacked_out = val
 
+    def copy(self):
+        """Return a new Square with the same contents."""
+        sq = Square(self.m, self.n)
+        sq._letter = self._letter
+        sq.id_ = self.id_
+        sq._blacked_out = self._blacked_out
+        sq.across_check = self.across_check
+        sq.down_check = self.down_check
+        return sq
+
     def __repr__(self):
         return 'Square@(%d, %d)=%s' % (self.m, self.n, self.letter)
 
@@ -88,18 +120,107 @@ class Grid(object):
 
     Example Usage:
         grid = Grid(5, 10)
-        sq = grid[0, 9] 
-        sq.letter = 'L'
+        grid.set_letter(0, 9, 'L')
+
+    Grids can be forked cheaply. A fork shares its rows and Squares with the
+    grid it came from, and a row is only copied when one of the grids changes
+    it. For that to work, Squares must only be changed through the grid's
+    methods (set_letter, set_id, blackout_square, ...), which replace the
+    Square with a changed copy instead of changing it in place. Every
+    replacement is logged so that changes can be undone back to a mark().
+
+    If the grid has a lexicon.Lexicon, each empty Square keeps masks of the
+    letters its across and down runs allow (Scrabble style cross-checks).
+    They're updated when letters are set and squares blacked out, so
+    feasibility checks don't have to walk the runs.
     """
 
-    def __init__(self, rows, columns):
+    def __init__(self, rows, columns, lexicon=None):
         self.num_rows = rows
         self.num_columns = columns
+        self.lexicon = lexicon
         self.grid = [[Square(m, n) for n in range(columns)] 
                                    for m in range(rows)]
+        self._owned_rows = set(range(rows))
+        self._undo_log = []
+        # NumPy arrays marking letters and blacked out squares, made by
+        # _masks when first needed and then kept up to date by _replace.
+        self._letter_mask = self._blacked_out_mask = None
+
+    @property
+    def all_spans(self):
+        """Return every span on the grid.
+
+        The spans only depend on the dimensions of the grid, so they're
+        computed once and shared by all grids of the same size.
+        """
+        key = (self.num_rows, self.num_columns)
+        if key not in _SPAN_CACHE:
+            _SPAN_CACHE[key] = frozenset(self._get_all_spans())
+        return _SPAN_CACHE[key]
+
+    def fork(self):
+        """Return a copy of the grid that shares its rows with this one.
+
+        The fork starts with an empty undo log.
+        """
+        fork = Grid.__new__(Grid)
+        fork.num_rows = self.num_rows
+        fork.num_columns = self.num_columns
+        fork.lexicon = self.lexicon
+        fork.grid = list(self.grid)
+        fork._owned_rows = set()
+        fork._undo_log = []
+        if self._letter_mask is None:
+            fork._letter_mask = fork._blacked_out_mask = None
+        else:
+            fork._letter_mask = self._letter_mask.copy()
+            fork._blacked_out_mask = self._blacked_out_mask.copy()
+        # The rows are shared now, so this grid has to copy them too.
+        self._owned_rows = set()
+        return fork
+
+    def _replace(self, m, n, sq):
+        """Put `sq` at (`m`, `n`), copying the row first if it's shared."""
+        if m not in self._owned_rows:
+            self.grid[m] = list(self.grid[m])
+            self._owned_rows.add(m)
+        self._undo_log.append((m, n, self.grid[m][n]))
+        self.grid[m][n] = sq
+        self._update_masks(m, n, sq)
+
+    def mark(self):
+        """Return a mark that undo() can return the grid to."""
+        return len(self._undo_log)
+
+    def undo(self, mark):
+        """Undo every change made to the grid since `mark` was made."""
+        while len(self._undo_log) > mark:
+            m, n, sq = self._undo_log.pop()
+            if m not in self._owned_rows:
+                self.grid[m] = list(self.grid[m])
+                self._owned_rows.add(m)
+            self.grid[m][n] = sq
+            self._update_masks(m, n, sq)
+
+    def _update_masks(self, m, n, sq):
+        """Mark `sq`, now at (`m`, `n`), in the masks if they've been made."""
+        if self._letter_mask is not None:
+            self._letter_mask[m, n] = sq.letter is not None
+            self._blacked_out_mask[m, n] = sq.blacked_out
+
+    def set_letter(self, m, n, letter):
+        """Set the letter of the square at (`m`, `n`)."""
+        sq = self.grid[m][n].copy()
+        sq.letter = letter
+        self._replace(m, n, sq)
+        self._update_checks(m, n)
 
-        # The spans don't change so they can be computed in the beginning.
-        self.all_spans = self._get_all_spans()
+    def set_id(self, m, n, id_):
+        """Set the clue number of the square at (`m`, `n`)."""
+        sq = self.grid[m][n].copy()
+        sq.id_ = id_
+        self._replace(m, n, sq)
 
     def __str__(self):
         """Return a text representation of the grid."""
@@ -116,7 +237,7 @@ class Grid(object):
 
     def __setitem__(self, (m, n), item):
         """Replace the default Square at (`m`, `n`) with `item`."""
-        self.grid[m][n] = item
+        self._replace(m, n, item)
 
     def __getitem__(self, (m, n)):
         """Return the Square at (`m`, `n`)."""
@@ -128,6 +249,10 @@ class Grid(object):
             for n in range(self.num_columns):
                 yield self.grid[m][n]
 
+    def has_letters(self):
+        """Return True if any square in the grid contains a letter."""
+        return any(sq.letter is not None for sq in self)
+
     def are_valid_coordinates(self, m, n):
         """Return True if (m, n) are coordinates for a square in the grid."""
         return 0 <= m < self.num_rows and 0 <= n < self.num_columns
@@ -136,15 +261,57 @@ class Grid(object):
         """Black out all open square in the grid."""
         for m in range(self.num_rows):
             for n in range(self.num_columns):
-                sq = self.grid[m][n]
-                if sq.letter is None:
-                    sq.blacked_out = True
+                self.blackout_square(m, n)
 
     def blackout_square(self, m, n):
         """Set `blacked_out` for the square at (`m`, `n`) to True."""
         sq = self.grid[m][n]
-        if sq.letter is None:
-            self.grid[m][n].blacked_out = True
+        if sq.letter is None and not sq.blacked_out:
+            sq = sq.copy()
+            sq.blacked_out = True
+            self._replace(m, n, sq)
+            self._update_checks(m, n)
+
+    def cross_check(self, m, n, direction):
+        """Return the mask of letters the `direction` run through (m, n) allows.
+        """
+        sq = self.grid[m][n]
+        return sq.across_check if direction == 'ACROSS' else sq.down_check
+
+    def _update_checks(self, m, n):
+        """Update the cross-checks that a change at (`m`, `n`) affects.
+
+        Only the runs through (m, n) changed, so only the nearest open square
+        past the letters on each side of it in each direction is updated.
+        """
+        if self.lexicon is None:
+            return
+        for direction, dm, dn in (('ACROSS', 0, 1), ('DOWN', 1, 0)):
+            for step in (-1, 1):
+                i, j = m + step * dm, n + step * dn
+                while (self.are_valid_coordinates(i, j) and
+                       self.grid[i][j].letter is not None):
+                    i, j = i + step * dm, j + step * dn
+                if (self.are_valid_coordinates(i, j) and
+                        not self.grid[i][j].blacked_out):
+                    self._set_check(i, j, direction)
+
+    def _set_check(self, m, n, direction):
+        """Recompute the `direction` cross-check of the open square (m, n)."""
+        before, after, open_before, open_after = self.get_neighbours(
+            m, n, direction)
+        if not before and not after:
+            mask = ALL_LETTERS
+        else:
+            mask = letter_mask(self.lexicon.feasible_letters(
+                before, after, open_before, open_after))
+        if mask != self.cross_check(m, n, direction):
+            sq = self.grid[m][n].copy()
+            if direction == 'ACROSS':
+                sq.across_check = mask
+            else:
+                sq.down_check = mask
+            self._replace(m, n, sq)
 
     @staticmethod
     def get_span_direction(span):
@@ -204,8 +371,143 @@ class Grid(object):
         return True
 
 
+    def get_fragment(self, m, n, direction, overlay=None):
+        """Return the run of letters through (`m`, `n`) going `direction`.
+
+        The return value is (fragment, open_before, open_after), where the
+        booleans say whether the square just before/after the run is on the
+        grid and not blacked out, i.e. whether the run could still grow.
+        `overlay` maps (m, n) to letters that should be treated as if they
+        were on the grid.
+        """
+        overlay = overlay or {}
+        dm, dn = (0, 1) if direction == 'ACROSS' else (1, 0)
+
+        def letter_at(m, n):
+            if (m, n) in overlay:
+                return overlay[m, n]
+            return self.grid[m][n].letter
+
+        def is_open(m, n):
+            return (self.are_valid_coordinates(m, n) and
+                    not self.grid[m][n].blacked_out)
+
+        first_m, first_n = m, n
+        while (self.are_valid_coordinates(first_m - dm, first_n - dn) and
+               letter_at(first_m - dm, first_n - dn) is not None):
+            first_m, first_n = first_m - dm, first_n - dn
+
+        letters = []
+        last_m, last_n = first_m, first_n
+        while (self.are_valid_coordinates(last_m, last_n) and
+               letter_at(last_m, last_n) is not None):
+            letters.append(letter_at(last_m, last_n))
+            last_m, last_n = last_m + dm, last_n + dn
+
+        return (''.join(letters), is_open(first_m - dm, first_n - dn),
+                is_open(last_m, last_n))
+
+    def get_neighbours(self, m, n, direction):
+        """Return the letters on either side of the open square (m, n).
+
+        The return value is (before, after, open_before, open_after), where
+        `before` and `after` are the runs of letters just before and after
+        (m, n) going `direction` and the booleans say whether the square past
+        each run is on the grid and not blacked out.
+        """
+        dm, dn = (0, 1) if direction == 'ACROSS' else (1, 0)
+
+        def run(step):
+            letters = []
+            i, j = m + step * dm, n + step * dn
+            while (self.are_valid_coordinates(i, j) and
+                   self.grid[i][j].letter is not None):
+                letters.append(self.grid[i][j].letter)
+                i, j = i + step * dm, j + step * dn
+            return letters, (self.are_valid_coordinates(i, j) and
+                             not self.grid[i][j].blacked_out)
+
+        before, open_before = run(-1)
+        after, open_after = run(1)
+        return (''.join(reversed(before)), ''.join(after), open_before,
+                open_after)
+
+    def span_pattern(self, span):
+        """Return the word search pattern for `span`, with "?" for any letter.
+
+        An empty square whose cross-check allows only one letter gets that
+        letter.
+        """
+        cross = 'DOWN' if self.get_span_direction(span) == 'ACROSS' else 'ACROSS'
+        pattern = []
+        for (m, n) in span:
+            sq = self.grid[m][n]
+            if sq.letter is not None:
+                pattern.append(sq.letter)
+                continue
+            letters = mask_letters(self.cross_check(m, n, cross))
+            pattern.append(letters[0] if len(letters) == 1 else '?')
+        return ''.join(pattern)
+
+    def span_is_feasible(self, span, lexicon):
+        """Return False if an empty square in `span` can't hold any letter.
+
+        Each empty square's crossing run of letters has to remain a possible
+        word in `lexicon` for some letter in the square. If `lexicon` is the
+        grid's lexicon the cross-checks answer this without walking the runs.
+        """
+        cross = 'DOWN' if self.get_span_direction(span) == 'ACROSS' else 'ACROSS'
+        for (m, n) in span:
+            if self.grid[m][n].letter is not None:
+                continue
+            if lexicon is self.lexicon:
+                if not self.cross_check(m, n, cross):
+                    return False
+                continue
+            before, after, open_before, open_after = self.get_neighbours(
+                m, n, cross)
+            if not before and not after:
+                continue
+            if not lexicon.feasible_letters(before, after, open_before,
+                                            open_after):
+                return False
+        return True
+
+    def placement_is_feasible(self, word, span, lexicon):
+        """Return True if placing `word` on `span` leaves no doomed runs.
+
+        Every run of letters crossing the new letters has to remain a possible
+        word in `lexicon`. The run along the span has to be `word` itself: if
+        the span ends next to a letter, the grid would hold a longer run than
+        the word its clue is stored for. The crossing runs are checked with
+        the cross-checks if `lexicon` is the grid's lexicon.
+        """
+        overlay = dict(zip(span, word))
+        direction = self.get_span_direction(span)
+        cross = 'DOWN' if direction == 'ACROSS' else 'ACROSS'
+
+        m, n = span[0]
+        fragment, _, _ = self.get_fragment(m, n, direction, overlay)
+        if fragment != word:
+            return False
+
+        for (m, n), letter in zip(span, word):
+            if self.grid[m][n].letter is not None:
+                continue
+            if lexicon is self.lexicon:
+                mask = self.cross_check(m, n, cross)
+                if mask != ALL_LETTERS and not letter_mask(letter) & mask:
+                    return False
+                continue
+            fragment, open_before, open_after = self.get_fragment(m, n, cross,
+                                                                  overlay)
+            if len(fragment) > 1 and not lexicon.is_feasible(
+                    fragment, open_before, open_after):
+                return False
+        return True
+
     def open_spans(self, max_words_touching=1):
-        """Return a generator of of open spans, where each span is a tuple
+        """Return an iterable of open spans, where each span is a tuple
 
         Each span is a tuple of (m, n) pairs, where either m or n increases.
 
@@ -215,7 +517,16 @@ class Grid(object):
            not all squares within it are filled with letters, 
            no square is blacked out, and
            no square is touching more than `max_words_touching` words.
+
+        If NumPy is installed the spans are found by _open_spans_numpy, which
+        returns the same spans as the pure Python checks.
         """
+        if np is not None:
+            return self._open_spans_numpy(max_words_touching)
+        return self._open_spans_python(max_words_touching)
+
+    def _open_spans_python(self, max_words_touching=1):
+        """Return a generator of open spans, checking each span in turn."""
         return (span for span in self.all_spans if
                 len(span) > 1 and
                 self.a_letter_is_in_span(span) and
@@ -225,6 +536,85 @@ class Grid(object):
                 self.span_not_touching_too_many_words(span, 
                                                       max_words_touching))
 
+    def _masks(self):
+        """Return 2D NumPy arrays marking letters and blacked out squares.
+
+        They're built from the Squares the first time and kept up to date
+        as squares change after that. They mustn't be changed by the caller.
+        """
+        if self._letter_mask is None:
+            self._letter_mask = np.array(
+                [[sq.letter is not None for sq in row] for row in self.grid],
+                dtype=bool)
+            self._blacked_out_mask = np.array(
+                [[sq.blacked_out for sq in row] for row in self.grid],
+                dtype=bool)
+        return self._letter_mask, self._blacked_out_mask
+
+    def _open_spans_numpy(self, max_words_touching=1):
+        """Return a list of the open spans, found with array operations.
+
+        The number of words touching each square is the sum of the letter mask
+        shifted in each of the four directions. Each row (and each column, by
+        working on the transposed masks) is then checked for every span at
+        once: with cumulative sums along the row, the number of letters,
+        blacked out squares and overcrowded squares in the span from i to j
+        is the difference of two prefix sums.
+        """
+        letters, blacked_out = self._masks()
+        touching = np.zeros(letters.shape, dtype=int)
+        touching[1:, :] += letters[:-1, :]
+        touching[:-1, :] += letters[1:, :]
+        touching[:, 1:] += letters[:, :-1]
+        touching[:, :-1] += letters[:, 1:]
+        crowded = ~letters & (touching > max_words_touching)
+
+        spans = []
+        for transposed in (False, True):
+            if transposed:
+                masks = (letters.T, blacked_out.T, crowded.T)
+            else:
+                masks = (letters, blacked_out, crowded)
+            for line, i, j in zip(*np.nonzero(self._open_runs(*masks))):
+                if transposed:
+                    spans.append(tuple((k, line) for k in range(i, j)))
+                else:
+                    spans.append(tuple((line, k) for k in range(i, j)))
+        return spans
+
+    @staticmethod
+    def _open_runs(letters, blacked_out, crowded):
+        """Return a (lines, length + 1, length + 1) boolean array of open spans.
+
+        Element [line, i, j] is True if squares i to j - 1 of the line form an
+        open span.
+        """
+        num_lines, length = letters.shape
+
+        def counts(mask):
+            sums = np.zeros((num_lines, length + 1), dtype=int)
+            np.cumsum(mask, axis=1, out=sums[:, 1:])
+            return sums[:, None, :] - sums[:, :, None]
+
+        num_letters = counts(letters)
+        span_length = (np.arange(length + 1)[None, :] -
+                       np.arange(length + 1)[:, None])
+
+        # span_not_touching_letter looks at the squares on either side of the
+        # first square of the span.
+        before = np.zeros((num_lines, length + 1), dtype=bool)
+        before[:, 1:length] = letters[:, :-1]
+        after = np.zeros((num_lines, length + 1), dtype=bool)
+        after[:, :length - 1] = letters[:, 1:]
+        not_touching = ~(before | after)
+
+        return ((span_length > 1)[None, :, :] &
+                (num_letters > 0) &
+                (counts(blacked_out) == 0) &
+                (num_letters < span_length[None, :, :]) &
+                not_touching[:, :, None] &
+                (counts(crowded) == 0))
+
     def _get_all_spans(self):
         """Return all possible spans on the grid.
         
@@ -233,13 +623,9 @@ class Grid(object):
         """
         long_spans = set()
         for m in range(self.num_rows):
-            vert_span = []
-            hor_span = []
-            for n in range(self.num_columns):
-                vert_span.append((m, n))
-                hor_span.append((n, m))
-            long_spans.add(tuple(vert_span))
-            long_spans.add(tuple(hor_span))
+            long_spans.add(tuple((m, n) for n in range(self.num_columns)))
+        for n in range(self.num_columns):
+            long_spans.add(tuple((m, n) for m in range(self.num_rows)))
     
         subspans = set()
         for span in long_spans:
@@ -248,9 +634,23 @@ class Grid(object):
                     subspans.add(span[i:j])
         return subspans
 
+# Maps (rows, columns) to the spans of grids of that size. See Grid.all_spans.
+_SPAN_CACHE = {}
+
 class WordnikAPIKeyError(Exception):
     """Raised when the given Wordnik API key isn't valid."""
 
+class PuzzleInPlay(Exception):
+    """Raised when a word is added to a puzzle someone has started playing."""
+
+class TimeBudgetExceeded(Exception):
+    """Raised when populating a puzzle runs past its time budget."""
+
+# Values of CrosswordPuzzle.stop_reason after populate_puzzle.
+STOPPED_WORD_COUNT = 'word count'
+STOPPED_GRID_FULL = 'grid full'
+STOPPED_TIME_BUDGET = 'time budget'
+
 class CrosswordPuzzle(object):
     """A crossword puzzle grid that automatically generates puzzles.
 
@@ -267,58 +667,206 @@ class CrosswordPuzzle(object):
 
     In order to create the puzzle you can use the populate_puzzle method, which
     uses Wordnik's Word of the Day as the first word and then adds the specified
-    number of words to the puzzle. 
+    number of words to the puzzle. If the grid already has letters on it the
+    Word of the Day is skipped and the words are built off those letters.
     """
 
-    def __init__(self, rows=15, columns=15, api_key=None):
+    def __init__(self, rows=15, columns=15, api_key=None, lexicon=None,
+                 wordnik=None, letter_stats=None, difficulty=None,
+                 word_index=None, validator=None, cache_address=None):
         """Create a `rows` X `columns` grid and initialize the clues dict.
         
-        If `api_key` is not set then the key in config.py is tried.
+        If `api_key` is not set then the key in config.py is tried. If a
+        lexicon.Lexicon is passed in as `lexicon` then spans and words that
+        would leave runs of letters no word can be made of are skipped. An
+        existing Wordnik client (or anything with the same methods) can be
+        passed in as `wordnik`, in which case `api_key` isn't used. If a
+        letterstats.LetterStats is passed in as `letter_stats`, the word
+        placed in a span is the one leaving the most fillable crossings rather
+        than the most common one.
+
+        `difficulty` is one of difficulty.DIFFICULTIES and limits the words to
+        those in its frequency band. If a difficulty.BandedIndex is passed in
+        as `word_index`, words are searched for in it instead of on Wordnik.
+        If a validator.WordValidator is passed in as `validator`, words that
+        would create runs of letters that aren't words are never placed.
+        If `cache_address` is the address of a wordnikcache server, the
+        Wordnik client made from `api_key` asks it before calling Wordnik.
         """
-        self.grid = Grid(rows, columns)
+        check_difficulty(difficulty)
+        self.grid = Grid(rows, columns, lexicon)
+        self.lexicon = lexicon
+        self.letter_stats = letter_stats
+        self.difficulty = difficulty
+        self.word_index = word_index
+        self.validator = validator
+        self.template = None
+        self.num_searches = 0
         self.clues = {}
-        api_key = api_key or config.WORDNIK_API_KEY
-        if not api_key:
-            raise WordnikAPIKeyError('Enter your Wordnik API key in config.py')
-        self.wordnik = Wordnik(api_key)
+        self._clues_shared = False
+        self._clue_log = []  # (key, previous clue) for each stored clue
+        if wordnik is None:
+            api_key = api_key or config.WORDNIK_API_KEY
+            if not api_key:
+                raise WordnikAPIKeyError('Enter your Wordnik API key in '
+                                         'config.py')
+            cache = cache_address and CacheClient(cache_address)
+            wordnik = Wordnik(api_key, cache=cache)
+        self.wordnik = wordnik
         self._current_sq_id = 1  # To keep track of Square IDs
+        self._solution = None
+        self._session = None
+        self._in_play = False  # Set once a letter is entered in self._session
+        self._deadline = None
+        self.stop_reason = None
 
     def __str__(self):
         """Return the grid as a string."""
         return str(self.grid)
 
-    def populate_puzzle(self, word_count):
-        """Try to `word_count` words/clues. Return the number of words added."""
+    def populate_puzzle(self, word_count, time_budget=None):
+        """Try to `word_count` words/clues. Return the number of words added.
+
+        If `time_budget` is given, stop adding words once that many seconds
+        have passed, keeping the words placed so far. Afterwards stop_reason
+        says whether the word count, a full grid or the time budget ended the
+        run.
+        """
         words_added = 0
-        if not self.clues:
-            self.place_first_word()
-            word_count -= 1
-            words_added += 1
-
-        for i in range(word_count):
-            result = self.find_and_add_a_word()
-            if result is None:
-                s = 'Grid filled up after adding %d words.' % len(self.clues)
-                print >> sys.stderr, s
-                break
-            else:
-                words_added += 1
+        self.stop_reason = STOPPED_WORD_COUNT
+        # Only a budget changes the client's timeout, and clients that aren't
+        # wordnik.Wordnik may not have one.
+        has_timeout = (time_budget is not None and
+                       hasattr(self.wordnik, 'timeout'))
+        if has_timeout:
+            timeout = self.wordnik.timeout
+        if time_budget is not None:
+            self._deadline = time.time() + time_budget
+        try:
+            if not self.clues and not self.grid.has_letters():
+                word_count -= 1
+                if self.place_first_word() is not None:
+                    words_added += 1
+
+            for i in range(word_count):
+                result = self.find_and_add_a_word()
+                if result is None:
+                    s = 'Grid filled up after adding %d words.' % len(self.clues)
+                    print >> sys.stderr, s
+                    self.stop_reason = STOPPED_GRID_FULL
+                    break
+                else:
+                    words_added += 1
+        except TimeBudgetExceeded:
+            s = 'Ran out of time after adding %d words.' % len(self.clues)
+            print >> sys.stderr, s
+            self.stop_reason = STOPPED_TIME_BUDGET
+        finally:
+            self._deadline = None
+            if has_timeout:
+                self.wordnik.timeout = timeout
 
         self.finalize()
         return words_added
 
+    def _check_deadline(self):
+        """Return the seconds left of the time budget, None if there is none.
+
+        Raise TimeBudgetExceeded if the budget is spent.
+        """
+        if self._deadline is None:
+            return None
+        remaining = self._deadline - time.time()
+        if remaining <= 0:
+            raise TimeBudgetExceeded()
+        return remaining
+
+    def _call_wordnik(self, method, *args, **kwargs):
+        """Call `method` of self.wordnik within the remaining time budget."""
+        remaining = self._check_deadline()
+        if remaining is None:
+            return getattr(self.wordnik, method)(*args, **kwargs)
+
+        if hasattr(self.wordnik, 'timeout'):
+            self.wordnik.timeout = remaining
+        try:
+            return getattr(self.wordnik, method)(*args, **kwargs)
+        except socket.timeout:
+            raise TimeBudgetExceeded()
+
+    def apply_template(self, template):
+        """Black out the squares of a templates.Template before filling.
+
+        From then on words are only placed in whole slots of the template, so
+        the layout stays as it is.
+        """
+        assert not self.clues, 'Templates must be applied to an empty puzzle.'
+        assert (template.rows, template.columns) == (self.grid.num_rows,
+                                                     self.grid.num_columns)
+        for m in range(template.rows):
+            for n in range(template.columns):
+                if template.is_black(m, n):
+                    self.grid.blackout_square(m, n)
+        self.template = template
+        self._template_slots = template.slots()
+
+    def candidate_spans(self):
+        """Return the spans a new word may be placed on.
+
+        These are the grid's open spans or, with a template, the slots that
+        have been started but not finished.
+        """
+        if self.template is None:
+            return self.grid.open_spans()
+        return [slot for slot in self._template_slots
+                if self.grid.a_letter_is_in_span(slot) and
+                   self.grid.span_not_full(slot)]
+
     def place_first_word(self, word=None):
         """Add the Wordnik Word of the Day as the first word in the puzzle.
         
-        If no word is passed in, the Wordnik Word of the Day is used. 
+        If no word is passed in, the Wordnik Word of the Day is used, unless
+        the puzzle has a difficulty; then the longest word of that difficulty
+        that fits the top row is searched for, since the Word of the Day can
+        be of any difficulty. With a template, the word goes in the longest
+        across slot and if no word is passed in one is searched for. Return
+        the word or None if none fit.
         """
+        if self.template is not None:
+            slots = sorted((slot for slot in self._template_slots
+                            if self.grid.get_span_direction(slot) == 'ACROSS'),
+                           key=len, reverse=True)
+            if word is not None:
+                fits = [slot for slot in slots if len(slot) == len(word)]
+                assert fits, 'No slot fits the first word.'
+                self.add_word(word, fits[0])
+                return word
+            for slot in slots:
+                words = self.search_words('?' * len(slot))
+                if words:
+                    word = max(words, key=lambda w: self.rank_word(w, slot))
+                    self.add_word(word['wordstring'], slot)
+                    return word['wordstring']
+            return None
+
+        if word is None and self.difficulty is not None:
+            for length in range(self.grid.num_columns, 1, -1):
+                span = [(0, n) for n in range(length)]
+                words = self.search_words('?' * length)
+                if words:
+                    word = max(words, key=lambda w: self.rank_word(w, span))
+                    self.add_word(word['wordstring'], span)
+                    return word['wordstring']
+            return None
+
         if word is None:
-            word = self.wordnik.word_of_the_day()['wordstring']
+            word = self._call_wordnik('word_of_the_day')['wordstring']
 
         #TODO: handle the WOTD being too long
         assert len(word) <= self.grid.num_columns, 'First word is too long.'
         span = [(0, n) for n in range(len(word))]
         self.add_word(word, span)
+        return word
             
     def find_and_add_a_word(self):
         """Find a word in the Wordnik corpus that fits the puzzle and add it.
@@ -326,26 +874,128 @@ class CrosswordPuzzle(object):
         If the search and addition are successful, return the wordstring. If
         not, return None.
         """
-        open_spans = sorted(self.grid.open_spans(), key=len, reverse=True)
+        open_spans = sorted(self.candidate_spans(), key=len, reverse=True)
         for span in open_spans:
-            query = ''.join([str(self.grid[m, n]) for (m, n) in span])
-            query = query.replace(' ', '?')
-            length = len(query)
-            words = self.wordnik.word_search(query, max_length=length, 
-                                             min_dictionary_count=1)
+            # With a word index no Wordnik call checks the time budget, and
+            # a pass over every span can take long on a big grid.
+            self._check_deadline()
+            if (self.lexicon is not None and
+                    not self.grid.span_is_feasible(span, self.lexicon)):
+                continue
+            words = self.search_words(self.grid.span_pattern(span))
+            if self.lexicon is not None:
+                words = [w for w in words if self.grid.placement_is_feasible(
+                         w['wordstring'], span, self.lexicon)]
+            if self.validator is not None:
+                words = [w for w in words if not self.validator.check_placement(
+                         self.grid, w['wordstring'], span)]
             if words:
-                word = max(words, key=lambda w: w['count'])
+                word = max(words, key=lambda w: self.rank_word(w, span))
                 self.add_word(word['wordstring'], span)
                 return word['wordstring']
         return None
 
+    def search_words(self, query):
+        """Return the words matching `query` within the puzzle's difficulty.
+
+        The word index is used if there is one, otherwise Wordnik is asked.
+        """
+        if self.word_index is not None:
+            return self.word_index.search(query, self.difficulty)
+        self.num_searches += 1
+        return self._call_wordnik('word_search', query, max_length=len(query),
+                                  min_dictionary_count=1,
+                                  **search_kwargs(self.difficulty))
+
+    def rank_word(self, word, span):
+        """Return a sort key for a word_search result to be placed on `span`.
+
+        Without letter statistics the most common word wins. With them, the
+        word whose crossings are easiest to fill wins and the count breaks ties.
+        """
+        if self.letter_stats is None:
+            return word['count']
+        fillability = self.letter_stats.fillability(self.grid,
+                                                    word['wordstring'], span)
+        return (fillability, word['count'])
+
     def store_clue(self, word, id_, direction, clue):
         """Store a word in self.clues. Call after putting word on the grid."""
-        self.clues[id_, direction] = (word, clue)
+        self._own_clues()
+        key = (id_, direction)
+        self._clue_log.append((key, self.clues.get(key)))
+        self.clues[key] = (word, clue)
+
+    def _own_clues(self):
+        """Copy self.clues if it's shared with a fork."""
+        if self._clues_shared:
+            self.clues = dict(self.clues)
+            self._clues_shared = False
+
+    #
+    # Forking and rolling back
+    #
+    def fork(self):
+        """Return a copy of the puzzle that can be changed independently.
+
+        The fork shares everything that doesn't change (the Wordnik client,
+        lexicon, indexes, template and span table) with this puzzle. The grid
+        and clues are shared too until either puzzle changes them, so forks
+        are cheap enough to keep thousands of them. The fork can't be rolled
+        back past the point it was made.
+        """
+        fork = CrosswordPuzzle.__new__(CrosswordPuzzle)
+        fork.__dict__.update(self.__dict__)
+        fork.grid = self.grid.fork()
+        fork._clue_log = []
+        fork._clues_shared = self._clues_shared = True
+        fork._session = None
+        fork._in_play = False
+        fork._deadline = None
+        return fork
+
+    def snapshot(self):
+        """Return a snapshot of the puzzle that rollback() can return to."""
+        return (self.grid.mark(), len(self._clue_log), self._current_sq_id)
+
+    def rollback(self, snapshot):
+        """Undo every word placed since `snapshot` was taken.
+
+        The entries made through enter_from_user are discarded with the words.
+        """
+        grid_mark, clue_mark, current_sq_id = snapshot
+        self.grid.undo(grid_mark)
+        self._own_clues()
+        while len(self._clue_log) > clue_mark:
+            key, previous = self._clue_log.pop()
+            if previous is None:
+                del self.clues[key]
+            else:
+                self.clues[key] = previous
+        self._current_sq_id = current_sq_id
+        self._solution = None
+        self._session = None
+        self._in_play = False
 
 
     def add_word(self, word, span):
-        """Place the word on the grid then add it and its clue to self.clues."""
+        """Place the word on the grid then add it and its clue to self.clues.
+
+        Raise PuzzleInPlay if letters have been entered through
+        enter_from_user, since the new word would change the solution they're
+        checked against. Sessions made with new_session() aren't tracked and
+        keep checking against the old solution.
+        """
+        if self._in_play:
+            raise PuzzleInPlay('Words cannot be added once the puzzle is '
+                               'being played.')
+        # A session nobody has entered letters in is just rebuilt later.
+        self._session = None
+        # Fetch the clue first so that running out of time never leaves a word
+        # on the grid without one.
+        definitions = self._call_wordnik('definitions', word)
+        definition = random.choice(definitions)['text']
+
         print >> sys.stderr, 'Placing word "%s".' % word
         self.put_word_on_grid(word, span)
         
@@ -354,15 +1004,16 @@ class CrosswordPuzzle(object):
         if first_square.id_ is None:
             id_ = self._current_sq_id
             self._current_sq_id += 1
-            first_square.id_ = id_
+            self.grid.set_id(m, n, id_)
         else:
             id_ = first_square.id_
-        definitions = self.wordnik.definitions(word)
-        definition = random.choice(definitions)['text']
         direction = self.grid.get_span_direction(span)
         
         self.store_clue(word, id_, direction, definition)
 
+        # The grid changed so any solution built from it is out of date.
+        self._solution = None
+
     def put_word_on_grid(self, word, span):
         """Add the nth letter in `word` to the nth position in `span`.  """
         assert len(word) == len(span)
@@ -370,23 +1021,22 @@ class CrosswordPuzzle(object):
         for i, char in enumerate(word):
             (m, n) = span[i]
             if self.grid[m, n].letter is None:
-                self.grid[m, n].letter = char
+                self.grid.set_letter(m, n, char)
             else:
                 assert self.grid[m, n].letter == char
 
         # Black out open squares on either end of the word if they exist.
+        (first_m, first_n), (last_m, last_n) = span[0], span[-1]
         direction = self.grid.get_span_direction(span)
         if direction == 'ACROSS':
-            for (m, n) in ((m, n - 1), (m, n + 1)):
-                if self.grid.are_valid_coordinates(m, n):
-                    self.grid.blackout_square(m, n)
-
+            ends = ((first_m, first_n - 1), (last_m, last_n + 1))
         elif direction == 'DOWN':
-            for (m, n) in ((m - 1, n), (m + 1, n)):
-                if self.grid.are_valid_coordinates(m, n):
-                    self.grid.blackout_square(m, n)
+            ends = ((first_m - 1, first_n), (last_m + 1, last_n))
         else:
             assert False, "Sanity check"
+        for (m, n) in ends:
+            if self.grid.are_valid_coordinates(m, n):
+                self.grid.blackout_square(m, n)
 
     def finalize(self):
         """Perform cleanup after all the words have been placed."""
@@ -395,25 +1045,49 @@ class CrosswordPuzzle(object):
     #
     # Gameplay related methods
     #
+    @property
+    def solution(self):
+        """Return the Solution for the puzzle, shared by all its sessions."""
+        if self._solution is None:
+            self._solution = Solution.from_puzzle(self)
+        return self._solution
+
+    def new_session(self):
+        """Return a new PlayerSession for the puzzle's solution."""
+        return PlayerSession(self.solution)
+
+    @property
+    def session(self):
+        """Return the session used by is_completed and enter_from_user."""
+        if self._session is None:
+            self._session = self.new_session()
+        return self._session
+
     @property
     def is_completed(self):
         """Return True if the user's entries match the correct letters."""
-        for sq in self.grid:
-            if sq.letter != sq.user_entry:
-                return False
-        return True
+        return self.session.is_completed
 
     def enter_from_user(self, m, n, letter):
-        """Set the value of the square at (`m`, `n`) to `letter`."""
-        sq = self.grid[m, n]
-        assert not sq.is_blacked_out
-        sq.letter = letter
+        """Set the user's entry for the square at (`m`, `n`) to `letter`."""
+        self.session.enter(m, n, letter)
+        self._in_play = True
 
 
-def make_puzzle(rows, columns, num_words, api_key=None):
-    """Return a `rows` by `columns` crossword puzzle with `num_words` words."""
-    puzzle = CrosswordPuzzle(rows, columns, api_key)
-    puzzle.populate_puzzle(num_words)
+def make_puzzle(rows, columns, num_words, api_key=None, lexicon=None,
+                time_budget=None, letter_stats=None, difficulty=None,
+                word_index=None, validator=None, wordnik=None,
+                cache_address=None):
+    """Return a `rows` by `columns` crossword puzzle with `num_words` words.
+
+    If `time_budget` is given, the puzzle holds whatever words could be placed
+    within that many seconds. See CrosswordPuzzle for the other arguments.
+    """
+    puzzle = CrosswordPuzzle(rows, columns, api_key, lexicon, wordnik,
+                             letter_stats=letter_stats, difficulty=difficulty,
+                             word_index=word_index, validator=validator,
+                             cache_address=cache_address)
+    puzzle.populate_puzzle(num_words, time_budget)
     puzzle.finalize()
     return puzzle
 
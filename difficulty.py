@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+Difficulty levels for puzzles, based on how frequent their words are.
+
+Frequent words are easier to guess, so each difficulty is a band of corpus
+counts (the `count` field of Wordnik's word search results). A puzzle can be
+restricted to a band in two ways:
+
+* Without an index, the band's bounds are passed to Wordnik's word search as
+  minCorpusCount/maxCorpusCount so the server only returns words in the band.
+* With a BandedIndex, words are found locally. The index is split into one
+  pattern index per band, so a search for an easy word matching "?a??e??"
+  only looks at easy seven letter words with an "a" second or an "e" fifth.
+
+>>> index = BandedIndex.from_counts([('cat', 52000), ('ocelot', 310)])
+>>> index.search('c??', 'easy')
+[{'wordstring': 'cat', 'count': 52000}]
+>>> puzzle = make_puzzle(15, 15, 40, difficulty='easy', word_index=index)
+"""
+
+
+from array import array
+from optparse import OptionParser
+import pickle
+import sys
+
+from lexicon import normalize
+
+
+EASY = 'easy'
+MEDIUM = 'medium'
+HARD = 'hard'
+DIFFICULTIES = (EASY, MEDIUM, HARD)
+
+# The inclusive (minimum, maximum) corpus count of each difficulty. None means
+# there's no bound.
+BANDS = {
+    EASY: (10000, None),
+    MEDIUM: (1000, 9999),
+    HARD: (None, 999),
+}
+
+
+class UnknownDifficulty(Exception):
+    """Raised for a difficulty that isn't one of DIFFICULTIES."""
+
+
+def check_difficulty(difficulty):
+    """Raise UnknownDifficulty unless `difficulty` is None or known."""
+    if difficulty is not None and difficulty not in BANDS:
+        raise UnknownDifficulty('Difficulty must be one of %s, not %r.' %
+                                (', '.join(DIFFICULTIES), difficulty))
+
+
+def band_of(count):
+    """Return the difficulty whose band contains the corpus count `count`."""
+    for difficulty in DIFFICULTIES:
+        low, high = BANDS[difficulty]
+        if (low is None or count >= low) and (high is None or count <= high):
+            return difficulty
+    assert False, 'The bands should cover every count.'
+
+
+def search_kwargs(difficulty):
+    """Return the Wordnik.word_search arguments restricting it to a band."""
+    check_difficulty(difficulty)
+    if difficulty is None:
+        return {}
+    low, high = BANDS[difficulty]
+    return {'min_corpus_count': low, 'max_corpus_count': high}
+
+
+class PatternIndex(object):
+    """Words indexed by length and by the letter at each position.
+
+    For each (length, position, letter) the index keeps a sorted array of the
+    ids of the words with that letter there. A pattern is matched by taking
+    the shortest of the arrays for its known letters and checking each word
+    in it against the rest of the pattern.
+    """
+
+    def __init__(self):
+        self.words = []
+        self.counts = array('L')
+        self.by_length = {}
+        self.by_letter = {}
+
+    def add(self, word, count):
+        id_ = len(self.words)
+        self.words.append(word)
+        self.counts.append(count)
+        self.by_length.setdefault(len(word), array('L')).append(id_)
+        for position, letter in enumerate(word):
+            key = (len(word), position, letter)
+            self.by_letter.setdefault(key, array('L')).append(id_)
+
+    def search(self, pattern):
+        """Return the (word, count) pairs matching `pattern`.
+
+        In `pattern` a "?" stands for any letter.
+        """
+        pattern = pattern.lower()
+        known = [(i, c) for i, c in enumerate(pattern) if c != '?']
+        candidates = self.by_length.get(len(pattern), ())
+        for i, letter in known:
+            ids = self.by_letter.get((len(pattern), i, letter), ())
+            if len(ids) < len(candidates):
+                candidates = ids
+        return [(self.words[id_], int(self.counts[id_])) for id_ in candidates
+                if all(self.words[id_][i] == c for i, c in known)]
+
+
+class BandedIndex(object):
+    """A PatternIndex for each difficulty band."""
+
+    def __init__(self):
+        self.bands = dict((difficulty, PatternIndex())
+                          for difficulty in DIFFICULTIES)
+
+    @classmethod
+    def from_counts(cls, pairs):
+        """Return an index of the (word, corpus count) pairs in `pairs`.
+
+        Words that aren't made up of the letters a-z are skipped.
+        """
+        index = cls()
+        seen = set()
+        for word, count in pairs:
+            word = normalize(word)
+            if word is None or word in seen:
+                continue
+            seen.add(word)
+            index.bands[band_of(count)].add(word, count)
+        return index
+
+    @classmethod
+    def load(cls, filename):
+        """Return the index pickled in `filename`."""
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, filename):
+        """Pickle the index to `filename`."""
+        with open(filename, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    def search(self, pattern, difficulty=None):
+        """Return words matching `pattern` like Wordnik.word_search does.
+
+        Only the band of `difficulty` is searched, or every band if it's None.
+        """
+        check_difficulty(difficulty)
+        difficulties = DIFFICULTIES if difficulty is None else [difficulty]
+        return [{'wordstring': word, 'count': count}
+                for d in difficulties
+                for word, count in self.bands[d].search(pattern)]
+
+
+def main(args):
+    parser = OptionParser(usage='%prog COUNTS_FILE OUTPUT_FILE\n\n'
+                          'COUNTS_FILE has a word and its corpus count, '
+                          'separated by a tab, on each line.')
+    options, args = parser.parse_args(args)
+    if len(args) != 2:
+        parser.error('A counts file and an output file must be specified.')
+    counts_file, output = args
+    with open(counts_file) as f:
+        pairs = (line.rstrip('\n').split('\t') for line in f if '\t' in line)
+        BandedIndex.from_counts((w, int(c)) for w, c in pairs).save(output)
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""
+Export puzzles to file formats that other crossword programs can open.
+
+Two formats are supported:
+    ipuz  The open JSON format described at http://ipuz.org.
+    puz   The binary Across Lite format, including its checksums.
+
+Both formats number the squares the standard way (left to right, top to
+bottom, every square that starts an across or down run of letters gets the
+next number), so the clue numbers in CrosswordPuzzle.clues, which follow the
+order the words were placed in, are renumbered on export.
+
+>>> open('puzzle.puz', 'wb').write(to_puz(puzzle))
+>>> export_puzzles(puzzle_generator(), 'puzzles.zip', 'ipuz')
+"""
+
+
+import os
+import struct
+import zipfile
+
+import simplejson as json
+
+
+IPUZ_VERSION = 'http://ipuz.org/v2'
+IPUZ_KIND = 'http://ipuz.org/crossword#1'
+PUZ_VERSION = '1.3\0'
+PUZ_MAGIC = 'ACROSS&DOWN\0'
+BLOCK = '#'
+
+
+def _has_letter(grid, m, n):
+    return grid.are_valid_coordinates(m, n) and grid[m, n].letter is not None
+
+
+def number_grid(grid):
+    """Return the standard numbering of `grid`.
+
+    The return value is a list of (number, (m, n), starts_across, starts_down)
+    in number order. Squares without letters are treated as blocks.
+    """
+    numbers = []
+    for m in range(grid.num_rows):
+        for n in range(grid.num_columns):
+            if not _has_letter(grid, m, n):
+                continue
+            across = (not _has_letter(grid, m, n - 1) and
+                      _has_letter(grid, m, n + 1))
+            down = (not _has_letter(grid, m - 1, n) and
+                    _has_letter(grid, m + 1, n))
+            if across or down:
+                numbers.append((len(numbers) + 1, (m, n), across, down))
+    return numbers
+
+
+def _renumbered_clues(puzzle):
+    """Return ({number: across clue}, {number: down clue}, numbering).
+
+    Every run of letters gets a clue. Runs that weren't placed as words, such
+    as the overlap of two parallel words, get an empty clue.
+    """
+    grid = puzzle.grid
+    starts = {}
+    for sq in grid:
+        if sq.id_ is not None:
+            starts[sq.id_] = (sq.m, sq.n)
+    texts = {}
+    for (id_, direction), (word, clue) in puzzle.clues.items():
+        texts[starts[id_], direction] = clue
+
+    numbering = number_grid(grid)
+    across, down = {}, {}
+    for number, position, starts_across, starts_down in numbering:
+        if starts_across:
+            across[number] = texts.get((position, 'ACROSS'), '')
+        if starts_down:
+            down[number] = texts.get((position, 'DOWN'), '')
+    return across, down, numbering
+
+
+def to_ipuz(puzzle, title=None, author=None):
+    """Return `puzzle` as an ipuz dictionary, ready to be dumped as JSON."""
+    grid = puzzle.grid
+    across, down, numbering = _renumbered_clues(puzzle)
+    numbers = dict((position, number)
+                   for number, position, _, _ in numbering)
+
+    cells, solution = [], []
+    for m in range(grid.num_rows):
+        cell_row, solution_row = [], []
+        for n in range(grid.num_columns):
+            if _has_letter(grid, m, n):
+                cell_row.append(numbers.get((m, n), 0))
+                solution_row.append(grid[m, n].letter.upper())
+            else:
+                cell_row.append(BLOCK)
+                solution_row.append(BLOCK)
+        cells.append(cell_row)
+        solution.append(solution_row)
+
+    ipuz = {
+        'version': IPUZ_VERSION,
+        'kind': [IPUZ_KIND],
+        'dimensions': {'width': grid.num_columns, 'height': grid.num_rows},
+        'block': BLOCK,
+        'puzzle': cells,
+        'solution': solution,
+        'clues': {'Across': [[k, v] for k, v in sorted(across.items())],
+                  'Down': [[k, v] for k, v in sorted(down.items())]},
+    }
+    if title is not None:
+        ipuz['title'] = title
+    if author is not None:
+        ipuz['author'] = author
+    return ipuz
+
+
+def _puz_string(text):
+    """Return `text` as a latin-1 byte string without NUL characters."""
+    if isinstance(text, unicode):
+        text = text.encode('latin-1', 'replace')
+    return text.replace('\0', '')
+
+
+def _checksum(data, checksum=0):
+    """Return the Across Lite checksum of the byte string `data`."""
+    for byte in bytearray(data):
+        if checksum & 1:
+            checksum = (checksum >> 1) + 0x8000
+        else:
+            checksum >>= 1
+        checksum = (checksum + byte) & 0xffff
+    return checksum
+
+
+def _text_checksum(title, author, copyright, clues, notes, checksum=0):
+    """Return the checksum of the strings section of a .puz file."""
+    for text in (title, author, copyright):
+        if text:
+            checksum = _checksum(text + '\0', checksum)
+    for clue in clues:
+        checksum = _checksum(clue, checksum)
+    if notes:
+        checksum = _checksum(notes + '\0', checksum)
+    return checksum
+
+
+def to_puz(puzzle, title='', author='', copyright='', notes=''):
+    """Return `puzzle` as the contents of an Across Lite .puz file."""
+    grid = puzzle.grid
+    across, down, numbering = _renumbered_clues(puzzle)
+
+    solution, fill = [], []
+    for sq in grid:
+        if sq.letter is None:
+            solution.append('.')
+            fill.append('.')
+        else:
+            solution.append(_puz_string(sq.letter.upper())[:1] or 'X')
+            fill.append('-')
+    solution, fill = ''.join(solution), ''.join(fill)
+
+    # Across Lite orders clues by number, across before down.
+    clues = []
+    for number, _, starts_across, starts_down in numbering:
+        if starts_across:
+            clues.append(_puz_string(across[number]))
+        if starts_down:
+            clues.append(_puz_string(down[number]))
+    title, author, copyright, notes = map(_puz_string,
+                                          (title, author, copyright, notes))
+
+    cib = struct.pack('<BBHHH', grid.num_columns, grid.num_rows, len(clues),
+                      0x0001, 0)
+    cib_checksum = _checksum(cib)
+    solution_checksum = _checksum(solution)
+    fill_checksum = _checksum(fill)
+    text_checksum = _text_checksum(title, author, copyright, clues, notes)
+
+    checksum = _checksum(solution, cib_checksum)
+    checksum = _checksum(fill, checksum)
+    checksum = _text_checksum(title, author, copyright, clues, notes, checksum)
+
+    parts = (cib_checksum, solution_checksum, fill_checksum, text_checksum)
+    masked_low = ''.join(chr(ord(c) ^ (x & 0xff))
+                         for c, x in zip('ICHE', parts))
+    masked_high = ''.join(chr(ord(c) ^ (x >> 8))
+                          for c, x in zip('ATED', parts))
+
+    header = (struct.pack('<H', checksum) + PUZ_MAGIC +
+              struct.pack('<H', cib_checksum) + masked_low + masked_high +
+              PUZ_VERSION + '\0' * 2 + struct.pack('<H', 0) + '\0' * 12 + cib)
+    strings = [title, author, copyright] + clues + [notes]
+    return header + solution + fill + '\0'.join(strings) + '\0'
+
+
+# Maps each format to its file extension and a function from a puzzle to the
+# contents of a file.
+FORMATS = {
+    'ipuz': ('.ipuz', lambda puzzle: json.dumps(to_ipuz(puzzle))),
+    'puz': ('.puz', to_puz),
+}
+
+
+def export_puzzles(puzzles, path, format_='puz'):
+    """Write every puzzle in the iterable `puzzles` to `path`.
+
+    If `path` ends in ".zip" the puzzles are written to a single zip archive,
+    otherwise they are written to files in the directory `path`. Puzzles are
+    written one at a time as they are taken from `puzzles`, so a generator of
+    puzzles is exported in constant memory. Return the number written.
+    """
+    extension, serialize = FORMATS[format_]
+    name = 'puzzle%06d' + extension
+
+    count = 0
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for count, puzzle in enumerate(puzzles, 1):
+                archive.writestr(name % count, serialize(puzzle))
+    else:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for count, puzzle in enumerate(puzzles, 1):
+            with open(os.path.join(path, name % count), 'wb') as f:
+                f.write(serialize(puzzle))
+    return count
@@ -33,3 +33,12 @@ def get_num_words_placed(puzzle):
     """Return the number of words placed in the puzzle."""
     return len(puzzle.clues)
 
+def get_words_per_search(puzzle):
+    """Return the number of words placed per call to Wordnik's word search.
+
+    The first word isn't found by searching so it isn't counted.
+    """
+    if puzzle.num_searches == 0:
+        return 0.0
+    return (len(puzzle.clues) - 1) / puzzle.num_searches
+
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+from __future__ import division
+
+"""
+Letter statistics for ranking candidate words by the fillability of crossings.
+
+Two tables are built once from a word list:
+
+* For every word length and position, how many words have each letter there,
+  e.g. how many 5 letter words have a "q" as their second letter.
+* For every word length, position and letter, the set of words with that
+  letter there, as a bitset over the words of that length. ANDing the sets
+  for the known letters of a pattern like "?r?w" and counting the bits gives
+  the number of words matching it without scanning the word list.
+
+Placing a word turns each empty square of its span into a letter that some
+crossing word will have to contain. fillability counts the words that could
+still be placed across each such square, given the letters already on the
+grid around it, so a word that leaves a "q" where only "qu?" could cross it
+ranks below one that leaves an "s".
+
+>>> LetterStats.from_lexicon(Lexicon.load('words.dawg')).save('words.stats')
+>>> stats = LetterStats.load('words.stats')
+>>> best = max(words, key=lambda w: stats.fillability(puzzle.grid, w, span))
+
+The file is a short header followed by the positional counts as an array of
+unsigned 32 bit ints and the words, one per line. It is loaded with a single
+read; the bitsets for a word length are built the first time it's needed.
+"""
+
+
+from array import array
+import binascii
+import math
+from optparse import OptionParser
+import string
+import struct
+import sys
+
+from lexicon import normalize
+
+
+MAGIC = 'CWLS'
+VERSION = 2
+ALPHABET = string.ascii_lowercase
+DEFAULT_MAX_LENGTH = 25
+
+# Memoized pattern counts are dropped once there are this many.
+MAX_CACHED_PATTERNS = 100000
+
+# What a crossing no word fits adds to fillability. It's far below the log of
+# any count, so a word that leaves a dead end ranks below one that doesn't.
+DEAD_END_SCORE = -100.0
+
+_HEADER = struct.Struct('<4sIII')
+
+
+class LetterStatsFormatError(Exception):
+    """Raised when a file isn't a letter statistics table."""
+
+
+def _bitset(ids):
+    """Return a long with the bits in the iterable `ids` set."""
+    data = bytearray()
+    for id_ in ids:
+        i = id_ >> 3
+        if i >= len(data):
+            data.extend('\0' * (i + 1 - len(data)))
+        data[i] |= 1 << (id_ & 7)
+    if not data:
+        return 0L
+    data.reverse()
+    return long(binascii.hexlify(data), 16)
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+class LetterStats(object):
+    """Counts of letters by word length and position, and pattern counts."""
+
+    def __init__(self, max_length, counts, words):
+        """`counts` is an array of (max_length + 1) * max_length * 26 ints.
+
+        `words` are the normalized words the counts were made from.
+        """
+        assert len(counts) == (max_length + 1) * max_length * len(ALPHABET)
+        self.max_length = max_length
+        self.counts = counts
+        self.words = words
+        # The number of words of each length is the sum of any position.
+        self.totals = [sum(counts[self._index(length, 0, 0):
+                                  self._index(length, 0, 0) + len(ALPHABET)])
+                       for length in range(max_length + 1)]
+        self._bitsets = {}  # length -> {(position, letter): bitset}
+        self._pattern_counts = {}
+
+    @classmethod
+    def from_words(cls, words, max_length=DEFAULT_MAX_LENGTH):
+        """Return the statistics of the iterable `words`."""
+        words = sorted(word for word in
+                       set(filter(None, (normalize(w) for w in words)))
+                       if len(word) <= max_length)
+        counts = array('I', [0]) * ((max_length + 1) * max_length *
+                                    len(ALPHABET))
+        stats = cls(max_length, counts, words)
+        for word in words:
+            for position, letter in enumerate(word):
+                counts[stats._index(len(word), position, letter)] += 1
+            stats.totals[len(word)] += 1
+        return stats
+
+    @classmethod
+    def from_lexicon(cls, lexicon, max_length=DEFAULT_MAX_LENGTH):
+        """Return the statistics of the words in a lexicon.Lexicon."""
+        return cls.from_words(iter(lexicon), max_length)
+
+    @classmethod
+    def load(cls, filename):
+        """Return the statistics stored in `filename`."""
+        with open(filename, 'rb') as f:
+            data = f.read()
+        if len(data) < _HEADER.size:
+            raise LetterStatsFormatError('File is truncated.')
+        magic, version, max_length, num_words = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise LetterStatsFormatError('Not a letter statistics file.')
+        counts = array('I')
+        end = _HEADER.size + (max_length + 1) * max_length * len(ALPHABET) * 4
+        if len(data) < end:
+            raise LetterStatsFormatError('File is truncated.')
+        counts.fromstring(data[_HEADER.size:end])
+        if sys.byteorder != 'little':
+            counts.byteswap()
+        words = data[end:].split('\n') if num_words else []
+        if len(words) != num_words:
+            raise LetterStatsFormatError('File is truncated.')
+        return cls(max_length, counts, words)
+
+    def save(self, filename):
+        """Write the statistics to `filename`."""
+        counts = array('I', self.counts)
+        if sys.byteorder != 'little':
+            counts.byteswap()
+        with open(filename, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, self.max_length,
+                                 len(self.words)))
+            counts.tofile(f)
+            f.write('\n'.join(self.words))
+
+    def _index(self, length, position, letter):
+        if not isinstance(letter, int):
+            letter = ALPHABET.index(letter)
+        return (length * self.max_length + position) * len(ALPHABET) + letter
+
+    def count(self, length, position, letter):
+        """Return the number of words of `length` with `letter` at `position`.
+
+        Letters outside a-z and lengths beyond max_length count as zero.
+        """
+        letter = letter.lower()
+        if (len(letter) != 1 or letter not in ALPHABET or
+                not 0 < length <= self.max_length):
+            return 0
+        return self.counts[self._index(length, position, letter)]
+
+    def probability(self, length, position, letter):
+        """Return the smoothed share of `length` letter words with `letter`
+        at `position`."""
+        length = min(length, self.max_length)
+        position = min(position, length - 1)
+        return ((self.count(length, position, letter) + 1) /
+                (self.totals[length] + len(ALPHABET)))
+
+    def _bitsets_of_length(self, length):
+        """Return {(position, letter): bitset of the words} for `length`."""
+        if length not in self._bitsets:
+            ids = {}
+            words = [word for word in self.words if len(word) == length]
+            for id_, word in enumerate(words):
+                for position, letter in enumerate(word):
+                    ids.setdefault((position, letter), []).append(id_)
+            bitsets = dict((key, _bitset(value))
+                           for key, value in ids.items())
+            bitsets['all'] = (1L << len(words)) - 1
+            self._bitsets[length] = bitsets
+        return self._bitsets[length]
+
+    def pattern_count(self, pattern):
+        """Return the number of words matching `pattern`.
+
+        In `pattern` a "?" stands for any letter.
+        """
+        pattern = pattern.lower()
+        if not 0 < len(pattern) <= self.max_length:
+            return 0
+        if pattern not in self._pattern_counts:
+            if len(self._pattern_counts) >= MAX_CACHED_PATTERNS:
+                self._pattern_counts.clear()
+            bitsets = self._bitsets_of_length(len(pattern))
+            bits = bitsets['all']
+            for position, letter in enumerate(pattern):
+                if letter != '?' and bits:
+                    bits &= bitsets.get((position, letter), 0)
+            self._pattern_counts[pattern] = _popcount(bits)
+        return self._pattern_counts[pattern]
+
+    def crossing_count(self, grid, m, n, direction, letter):
+        """Return how many words could go `direction` through (m, n).
+
+        (m, n) is taken to hold `letter`. A crossing word has to cover the
+        run of letters through (m, n), stay within the squares that aren't
+        blacked out and not end next to a letter, since the squares at either
+        end of a placed word are blacked out. The words matching every such
+        placement are counted, so a longer slot with more room counts more.
+        """
+        dm, dn = (0, 1) if direction == 'ACROSS' else (1, 0)
+
+        def is_open(i):
+            mm, nn = m + i * dm, n + i * dn
+            return (grid.are_valid_coordinates(mm, nn) and
+                    not grid[mm, nn].blacked_out)
+
+        def letter_at(i):
+            if i == 0:
+                return letter
+            return grid[m + i * dm, n + i * dn].letter
+
+        # The open slot through (m, n) is squares first to last, and the run
+        # of letters through it is squares a to b, relative to (m, n).
+        first = 0
+        while is_open(first - 1):
+            first -= 1
+        last = 0
+        while is_open(last + 1):
+            last += 1
+        a = 0
+        while a > first and letter_at(a - 1) is not None:
+            a -= 1
+        b = 0
+        while b < last and letter_at(b + 1) is not None:
+            b += 1
+
+        total = 0
+        for start in range(first, a + 1):
+            if start > first and letter_at(start - 1) is not None:
+                continue
+            for end in range(b, min(last, start + self.max_length - 1) + 1):
+                if end == start:
+                    continue
+                if end < last and letter_at(end + 1) is not None:
+                    continue
+                pattern = ''.join(letter_at(i) or '?'
+                                  for i in range(start, end + 1))
+                total += self.pattern_count(pattern)
+        return total
+
+    def fillability(self, grid, word, span):
+        """Return how fillable the crossings of `word` on `span` would be.
+
+        For every empty square of `span` the crossing words that could still
+        be placed through its new letter are counted with crossing_count. The
+        score is the sum of the logs of the counts, with DEAD_END_SCORE for
+        a count of zero, so higher is better. Squares that no crossing word
+        can reach don't count.
+        """
+        direction = grid.get_span_direction(span)
+        cross = 'DOWN' if direction == 'ACROSS' else 'ACROSS'
+        dm, dn = (0, 1) if cross == 'ACROSS' else (1, 0)
+        score = 0.0
+        for (m, n), letter in zip(span, word):
+            if grid[m, n].letter is not None:
+                continue
+            reachable = any(
+                grid.are_valid_coordinates(m + i, n + j) and
+                not grid[m + i, n + j].blacked_out
+                for i, j in ((-dm, -dn), (dm, dn)))
+            if reachable:
+                count = self.crossing_count(grid, m, n, cross, letter)
+                score += math.log(count) if count else DEAD_END_SCORE
+        return score
+
+
+def main(args):
+    parser = OptionParser(usage='%prog WORD_LIST OUTPUT_FILE')
+    parser.add_option('-l', '--max-length', dest='max_length', type='int',
+                      default=DEFAULT_MAX_LENGTH)
+    options, args = parser.parse_args(args)
+    if len(args) != 2:
+        parser.error('A word list and an output file must be specified.')
+    word_list, output = args
+    with open(word_list) as f:
+        LetterStats.from_words(f, options.max_length).save(output)
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
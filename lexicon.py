@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+
+"""
+A compact word list for checking fragments of words without asking Wordnik.
+
+The words are stored as a directed acyclic word graph (DAWG): a trie in which
+identical subtrees are merged, so that common endings like "-ing" are only
+stored once. Two graphs are kept, one of the words and one of the words spelled
+backwards, which makes it cheap to check whether a string can begin a word, end
+a word or is a word.
+
+A lexicon is built once from a plain word list and written to a file that is
+read through mmap, so many worker processes can share one copy of it.
+
+>>> Lexicon.build(open('words.txt'), 'words.dawg')
+>>> lexicon = Lexicon.load('words.dawg')
+>>> lexicon.is_prefix('tn')
+False
+>>> 'crow' in lexicon
+True
+
+File format (all integers are little-endian):
+    header: magic 'CWDG', version, number of forward edges, number of reverse
+            edges, each an unsigned 32 bit int
+    edges:  the forward graph's edges followed by the reverse graph's edges
+
+Each edge is an unsigned 32 bit int. The low 8 bits are the letter, bit 8 is set
+if a word ends after the letter, bit 9 is set on the last edge of a node and
+the remaining 22 bits are the index of the child node's first edge (0 if the
+child has no edges). Edge 0 of each graph is a placeholder pointing at the
+root node.
+"""
+
+
+import mmap
+from optparse import OptionParser
+import string
+import struct
+import sys
+
+
+MAGIC = 'CWDG'
+VERSION = 1
+ALPHABET = string.ascii_lowercase
+
+# Sets of letters can be stored as masks with a bit per letter of ALPHABET.
+ALL_LETTERS = (1 << len(ALPHABET)) - 1
+_LETTER_BITS = dict((letter, 1 << i) for i, letter in enumerate(ALPHABET))
+
+_HEADER = struct.Struct('<4sIII')
+_EDGE = struct.Struct('<I')
+
+_LETTER_MASK = 0xff
+_FINAL = 1 << 8
+_LAST = 1 << 9
+_CHILD_SHIFT = 10
+_MAX_EDGES = 1 << (32 - _CHILD_SHIFT)
+
+
+class LexiconFormatError(Exception):
+    """Raised when a file isn't a lexicon or was written by another version."""
+
+
+def normalize(word):
+    """Return `word` as it's stored in a lexicon or None if it can't be."""
+    word = word.strip().lower()
+    if word and all(char in ALPHABET for char in word):
+        return str(word)
+    return None
+
+
+def letter_mask(letters):
+    """Return the mask of `letters`. Letters not in ALPHABET are ignored."""
+    mask = 0
+    for letter in letters:
+        mask |= _LETTER_BITS.get(letter.lower(), 0)
+    return mask
+
+
+def mask_letters(mask):
+    """Return the letters in `mask` in alphabetical order."""
+    return [letter for letter in ALPHABET if mask & _LETTER_BITS[letter]]
+
+
+class _Node(object):
+    """A node of the DAWG while it's being built."""
+
+    __slots__ = ('edges', 'final')
+
+    def __init__(self):
+        self.edges = {}
+        self.final = False
+
+    def signature(self):
+        """Return a key that is equal for nodes with identical subgraphs."""
+        return (self.final,
+                tuple((letter, id(child))
+                      for letter, child in sorted(self.edges.items())))
+
+
+def _build_graph(words):
+    """Return the root _Node of a minimal DAWG of the sorted `words`.
+
+    This is the incremental algorithm of Daciuk et al., which minimizes the
+    part of the trie that can no longer change after each word is added.
+    """
+    root = _Node()
+    register = {}
+    unchecked = []  # (parent, letter, child) not yet merged into register
+    previous = ''
+
+    def minimize(down_to):
+        while len(unchecked) > down_to:
+            parent, letter, child = unchecked.pop()
+            signature = child.signature()
+            if signature in register:
+                parent.edges[letter] = register[signature]
+            else:
+                register[signature] = child
+
+    for word in words:
+        assert word > previous, 'Words must be sorted and unique.'
+        common = 0
+        for a, b in zip(word, previous):
+            if a != b:
+                break
+            common += 1
+        minimize(common)
+
+        node = unchecked[-1][2] if unchecked else root
+        for letter in word[common:]:
+            child = _Node()
+            node.edges[letter] = child
+            unchecked.append((node, letter, child))
+            node = child
+        node.final = True
+        previous = word
+    minimize(0)
+    return root
+
+
+def _serialize_graph(root):
+    """Return the edges of the graph at `root` as a list of ints."""
+    offsets = {}
+    order = []
+    stack = [root]
+    size = 1  # Edge 0 is the placeholder pointing at the root.
+    while stack:
+        node = stack.pop()
+        if id(node) in offsets or not node.edges:
+            continue
+        offsets[id(node)] = size
+        order.append(node)
+        size += len(node.edges)
+        stack.extend(node.edges.values())
+
+    if size > _MAX_EDGES:
+        raise ValueError('Too many edges (%d) for the lexicon format.' % size)
+
+    edges = [offsets.get(id(root), 0) << _CHILD_SHIFT]
+    for node in order:
+        items = sorted(node.edges.items())
+        for i, (letter, child) in enumerate(items):
+            edge = ord(letter) | offsets.get(id(child), 0) << _CHILD_SHIFT
+            if child.final:
+                edge |= _FINAL
+            if i == len(items) - 1:
+                edge |= _LAST
+            edges.append(edge)
+    return edges
+
+
+def _pack(words):
+    """Return the lexicon file contents for the iterable `words`."""
+    words = sorted(set(filter(None, (normalize(w) for w in words))))
+    forward = _serialize_graph(_build_graph(words))
+    reverse = _serialize_graph(_build_graph(sorted(w[::-1] for w in words)))
+    header = _HEADER.pack(MAGIC, VERSION, len(forward), len(reverse))
+    edges = forward + reverse
+    return header + struct.pack('<%dI' % len(edges), *edges)
+
+
+class Lexicon(object):
+    """A read-only set of words that also answers prefix and suffix queries.
+
+    Use Lexicon.load for a lexicon file or Lexicon.from_words to build one in
+    memory. All queries are case insensitive.
+    """
+
+    def __init__(self, data):
+        """Wrap `data`, the contents of a lexicon file as a string or mmap."""
+        if len(data) < _HEADER.size:
+            raise LexiconFormatError('Lexicon file is truncated.')
+        magic, version, num_forward, num_reverse = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise LexiconFormatError('Not a lexicon file.')
+        if version != VERSION:
+            raise LexiconFormatError('Unsupported lexicon version %d.' % version)
+        if len(data) != _HEADER.size + 4 * (num_forward + num_reverse):
+            raise LexiconFormatError('Lexicon file is truncated.')
+        self._data = data
+        self._forward = _HEADER.size
+        self._reverse = _HEADER.size + 4 * num_forward
+
+    @classmethod
+    def load(cls, filename):
+        """Return the lexicon stored in `filename`, mapped read-only."""
+        with open(filename, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data)
+
+    @classmethod
+    def from_words(cls, words):
+        """Return a lexicon of the iterable `words` held in memory."""
+        return cls(_pack(words))
+
+    @staticmethod
+    def build(words, filename):
+        """Write a lexicon of the iterable `words` to `filename`."""
+        with open(filename, 'wb') as f:
+            f.write(_pack(words))
+
+    def _edge(self, graph, i):
+        return _EDGE.unpack_from(self._data, graph + 4 * i)[0]
+
+    def _edges(self, graph, node):
+        """Yield (letter, final, child) for each edge leaving `node`."""
+        if node == 0:
+            return
+        i = node
+        while True:
+            edge = self._edge(graph, i)
+            yield (chr(edge & _LETTER_MASK), bool(edge & _FINAL),
+                   edge >> _CHILD_SHIFT)
+            if edge & _LAST:
+                return
+            i += 1
+
+    def _walk(self, graph, node, chars):
+        """Follow `chars` from `node`. Return (node, final) or None."""
+        final = False
+        for char in chars:
+            for letter, final, child in self._edges(graph, node):
+                if letter == char:
+                    node = child
+                    break
+            else:
+                return None
+        return node, final
+
+    def _root(self, graph):
+        return self._edge(graph, 0) >> _CHILD_SHIFT
+
+    def __contains__(self, word):
+        return self.is_word(word)
+
+    def __iter__(self):
+        """Yield every word in the lexicon in alphabetical order."""
+        root = self._root(self._forward)
+        stack = [(letter, final, child) for letter, final, child
+                 in reversed(list(self._edges(self._forward, root)))]
+        while stack:
+            prefix, final, node = stack.pop()
+            if final:
+                yield prefix
+            for letter, final, child in reversed(list(self._edges(
+                    self._forward, node))):
+                stack.append((prefix + letter, final, child))
+
+    def is_word(self, word):
+        """Return True if `word` is in the lexicon."""
+        found = self._walk(self._forward, self._root(self._forward),
+                           word.lower())
+        return found is not None and found[1]
+
+    def is_prefix(self, fragment):
+        """Return True if some word in the lexicon begins with `fragment`."""
+        return self._walk(self._forward, self._root(self._forward),
+                          fragment.lower()) is not None
+
+    def is_suffix(self, fragment):
+        """Return True if some word in the lexicon ends with `fragment`."""
+        return self._walk(self._reverse, self._root(self._reverse),
+                          fragment.lower()[::-1]) is not None
+
+    def is_feasible(self, fragment, open_before, open_after):
+        """Return True if `fragment` can still become part of a word.
+
+        `open_before` and `open_after` say whether letters may still be added
+        before and after the fragment. Fragments open on both ends can be in
+        the middle of any word and are always considered feasible.
+        """
+        if open_before and open_after:
+            return True
+        elif open_after:
+            return self.is_prefix(fragment)
+        elif open_before:
+            return self.is_suffix(fragment)
+        else:
+            return self.is_word(fragment)
+
+    def feasible_letters(self, before, after, open_before, open_after):
+        """Return the letters x for which `before` + x + `after` is feasible.
+
+        See is_feasible for the meaning of `open_before` and `open_after`.
+        """
+        if open_before and open_after:
+            return set(ALPHABET)
+
+        letters = set()
+        if not open_before:
+            graph, lead, trail, open_end = (self._forward, before.lower(),
+                                            after.lower(), open_after)
+        else:
+            graph, lead, trail, open_end = (self._reverse, after.lower()[::-1],
+                                            before.lower()[::-1], True)
+        found = self._walk(graph, self._root(graph), lead)
+        if found is None:
+            return letters
+        for letter, final, child in self._edges(graph, found[0]):
+            if not trail:
+                if open_end or final:
+                    letters.add(letter)
+                continue
+            end = self._walk(graph, child, trail)
+            if end is not None and (open_end or end[1]):
+                letters.add(letter)
+        return letters
+
+
+def main(args):
+    parser = OptionParser(usage='%prog WORD_LIST OUTPUT_FILE')
+    options, args = parser.parse_args(args)
+    if len(args) != 2:
+        parser.error('A word list and an output file must be specified.')
+    word_list, output = args
+    with open(word_list) as f:
+        Lexicon.build(f, output)
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+
+"""
+A daemon that keeps a stock of ready-made puzzles and hands them out quickly.
+
+Making a puzzle takes many seconds of Wordnik round trips, which is too slow to
+do while someone waits for it. The daemon keeps a target number of finished
+puzzles for each (rows, columns, difficulty) in memory and refills them in the
+background with a pool of worker processes. Puzzles are handed out over a
+line-based protocol on a local TCP socket:
+
+    GET <rows> <columns> [<difficulty>]   ->  OK <ipuz JSON>  or  EMPTY
+    STATS                                 ->  OK <JSON of the metrics>
+
+Each request and response is a single line. The daemon never generates a
+puzzle while a client waits: if the stock is empty the client gets EMPTY and
+can fall back to crosswordnik.make_puzzle.
+
+    python puzzlepool.py --stock 15x15:easy=50 --stock 10x10=20 --processes 4
+
+With --cache the workers share a wordnikcache.py server, so the API quota
+isn't used up once per worker.
+
+>>> get_puzzle(15, 15, 'easy')
+{'version': 'http://ipuz.org/v2', ...}
+"""
+
+
+from collections import deque
+import multiprocessing
+from optparse import OptionParser
+import os
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import traceback
+
+import simplejson as json
+
+from crosswordnik import make_puzzle
+from difficulty import BandedIndex, check_difficulty
+import export
+from letterstats import LetterStats
+from lexicon import Lexicon
+from wordnik import Wordnik
+from wordnikcache import CacheClient, parse_address
+
+import config
+
+
+DEFAULT_ADDRESS = ('127.0.0.1', 7337)
+
+# How far back the refill rate is measured, in seconds.
+RATE_WINDOW = 60
+
+# After a key fails, it isn't claimed again for RETRY_DELAY seconds, doubled
+# for each further failure in a row up to MAX_RETRY_DELAY.
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 300
+
+
+def words_for_size(rows, columns):
+    """Return how many words to try to place in a `rows` X `columns` puzzle."""
+    return 2 * max(rows, columns)
+
+
+# Set in each worker process by _init_worker.
+_worker = {}
+
+
+def _init_worker(api_key, wordnik, lexicon_path, index_path, stats_path,
+                 time_budget, cache_address):
+    """Load the word data once per worker process."""
+    # Placement messages from every worker would flood the daemon's log.
+    sys.stderr = open(os.devnull, 'w')
+    if wordnik is None and cache_address is not None:
+        # One client, and so one connection to the cache, per worker.
+        wordnik = Wordnik(api_key or config.WORDNIK_API_KEY,
+                          cache=CacheClient(cache_address))
+    _worker['api_key'] = api_key
+    _worker['wordnik'] = wordnik
+    _worker['time_budget'] = time_budget
+    _worker['lexicon'] = lexicon_path and Lexicon.load(lexicon_path)
+    _worker['word_index'] = index_path and BandedIndex.load(index_path)
+    _worker['letter_stats'] = stats_path and LetterStats.load(stats_path)
+
+
+def _generate(key):
+    """Make a puzzle for `key` in a worker. Return (key, ipuz JSON, error)."""
+    rows, columns, difficulty = key
+    try:
+        puzzle = make_puzzle(rows, columns, words_for_size(rows, columns),
+                             _worker['api_key'], _worker['lexicon'],
+                             _worker['time_budget'], _worker['letter_stats'],
+                             difficulty, _worker['word_index'],
+                             wordnik=_worker['wordnik'])
+        return key, json.dumps(export.to_ipuz(puzzle)), None
+    except Exception:
+        return key, None, traceback.format_exc()
+
+
+class PuzzleStock(object):
+    """Finished puzzles waiting to be handed out, and the refill metrics.
+
+    All methods are thread safe.
+    """
+
+    def __init__(self, targets):
+        """`targets` maps (rows, columns, difficulty) to the stock to keep."""
+        self.targets = dict(targets)
+        self.puzzles = dict((key, deque()) for key in self.targets)
+        self.in_flight = dict((key, 0) for key in self.targets)
+        self.failures = dict((key, 0) for key in self.targets)  # In a row
+        self.retry_at = dict((key, 0) for key in self.targets)
+        self.generated = 0
+        self.failed = 0
+        self.served = 0
+        self.misses = 0
+        self._finished = deque()  # When recent puzzles were generated
+        self.changed = threading.Condition()
+
+    def take(self, key):
+        """Remove and return the oldest puzzle for `key` or None if none."""
+        with self.changed:
+            if not self.puzzles.get(key):
+                self.misses += 1
+                return None
+            self.served += 1
+            created, puzzle = self.puzzles[key].popleft()
+            self.changed.notify_all()
+            return puzzle
+
+    def claim(self, max_in_flight):
+        """Return a list of keys to generate puzzles for.
+
+        A key is claimed only while its stock plus the puzzles being made for
+        it is below its target, and no more than `max_in_flight` puzzles are
+        made at once. This is what keeps the workers idle when the stock is
+        full and keeps the pool's queue from growing without bound.
+
+        A key that failed isn't claimed until its retry delay is over, and
+        then only one puzzle at a time until one is made.
+        """
+        claimed = []
+        now = time.time()
+        with self.changed:
+            busy = sum(self.in_flight.values())
+            for key in sorted(self.targets, key=self._fill_ratio):
+                if self.failures[key] and (self.retry_at[key] > now or
+                                           self.in_flight[key]):
+                    continue
+                while (busy < max_in_flight and
+                       len(self.puzzles[key]) + self.in_flight[key] <
+                       self.targets[key]):
+                    self.in_flight[key] += 1
+                    busy += 1
+                    claimed.append(key)
+                    if self.failures[key]:
+                        break
+        return claimed
+
+    def _fill_ratio(self, key):
+        return ((len(self.puzzles[key]) + self.in_flight[key]) /
+                float(self.targets[key] or 1))
+
+    def add(self, result):
+        """Store the result of _generate."""
+        key, puzzle, error = result
+        with self.changed:
+            self.in_flight[key] -= 1
+            if puzzle is None:
+                self.failed += 1
+                self.failures[key] += 1
+                self.retry_at[key] = time.time() + min(
+                    RETRY_DELAY * 2 ** (self.failures[key] - 1),
+                    MAX_RETRY_DELAY)
+                print >> sys.stderr, 'Failed to make a %r puzzle:\n%s' % (
+                    key, error)
+            else:
+                self.generated += 1
+                self.failures[key] = 0
+                now = time.time()
+                self.puzzles[key].append((now, puzzle))
+                self._finished.append(now)
+            self.changed.notify_all()
+
+    def stats(self):
+        """Return a dictionary of the stock levels and refill metrics."""
+        now = time.time()
+        with self.changed:
+            while self._finished and self._finished[0] < now - RATE_WINDOW:
+                self._finished.popleft()
+            stock = []
+            for key in sorted(self.targets):
+                rows, columns, difficulty = key
+                puzzles = self.puzzles[key]
+                stock.append({
+                    'rows': rows,
+                    'columns': columns,
+                    'difficulty': difficulty,
+                    'target': self.targets[key],
+                    'stock': len(puzzles),
+                    'in_flight': self.in_flight[key],
+                    'oldest_age': now - puzzles[0][0] if puzzles else None,
+                    'failures': self.failures[key],
+                    'retry_in': (max(self.retry_at[key] - now, 0)
+                                 if self.failures[key] else None),
+                })
+            return {
+                'stock': stock,
+                'refill_rate_per_minute': len(self._finished) * 60.0 /
+                                          RATE_WINDOW,
+                'generated': self.generated,
+                'failed': self.failed,
+                'served': self.served,
+                'misses': self.misses,
+            }
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    """Answers each request line sent over a connection."""
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            try:
+                response = self.server.respond(line.split())
+            except Exception, error:
+                response = 'ERROR %s' % str(error).replace('\n', ' ')
+            self.wfile.write(response + '\n')
+            self.wfile.flush()
+
+
+class PuzzleDaemon(SocketServer.ThreadingTCPServer):
+    """Serves puzzles from a PuzzleStock that worker processes keep full."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, targets, address=DEFAULT_ADDRESS, processes=None,
+                 api_key=None, lexicon_path=None, index_path=None,
+                 stats_path=None, time_budget=None, wordnik=None,
+                 cache_address=None):
+        """`targets` maps (rows, columns, difficulty) to the stock to keep.
+
+        The Wordnik client is made from `api_key` in each worker, or `wordnik`
+        (which must be picklable) is used instead. If `cache_address` is the
+        address of a wordnikcache server, the workers' clients share it, and
+        with it the API quota. The paths are files made by lexicon.py, difficulty.py and
+        letterstats.py, loaded by each worker. `time_budget` limits the
+        seconds spent on each puzzle.
+        """
+        for rows, columns, difficulty in targets:
+            check_difficulty(difficulty)
+        SocketServer.ThreadingTCPServer.__init__(self, address,
+                                                 _RequestHandler)
+        self.stock = PuzzleStock(targets)
+        processes = processes or multiprocessing.cpu_count()
+        self.max_in_flight = processes
+        self.pool = multiprocessing.Pool(
+            processes, _init_worker,
+            (api_key, wordnik, lexicon_path, index_path, stats_path,
+             time_budget, cache_address))
+        self._stopping = False
+        self._refiller = threading.Thread(target=self._refill)
+        self._refiller.daemon = True
+
+    def serve_forever(self, *args, **kwargs):
+        self._refiller.start()
+        try:
+            SocketServer.ThreadingTCPServer.serve_forever(self, *args,
+                                                          **kwargs)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop refilling and kill the worker processes."""
+        with self.stock.changed:
+            self._stopping = True
+            self.stock.changed.notify_all()
+        self.pool.terminate()
+
+    def _refill(self):
+        """Keep the workers busy until every stock reaches its target."""
+        while True:
+            with self.stock.changed:
+                if self._stopping:
+                    return
+                keys = self.stock.claim(self.max_in_flight)
+                if not keys:
+                    # Wait for a puzzle to be taken or a worker to finish.
+                    self.stock.changed.wait(1)
+                    continue
+            for key in keys:
+                self.pool.apply_async(_generate, (key,),
+                                      callback=self.stock.add)
+
+    def respond(self, request):
+        """Return the response line for the split request line `request`."""
+        if not request:
+            raise ValueError('Empty request.')
+        command, args = request[0].upper(), request[1:]
+        if command == 'GET' and len(args) in (2, 3):
+            key = (int(args[0]), int(args[1]),
+                   args[2] if len(args) == 3 else None)
+            puzzle = self.stock.take(key)
+            return 'EMPTY' if puzzle is None else 'OK ' + puzzle
+        elif command == 'STATS' and not args:
+            return 'OK ' + json.dumps(self.stock.stats())
+        raise ValueError('Unknown request %r.' % ' '.join(request))
+
+
+def _request(line, address):
+    """Send one request line to the daemon and return the response line."""
+    con = socket.create_connection(address)
+    try:
+        con.sendall(line + '\n')
+        f = con.makefile('rb')
+        response = f.readline().rstrip('\n')
+        f.close()
+    finally:
+        con.close()
+    status, _, body = response.partition(' ')
+    if status == 'ERROR':
+        raise ValueError(body)
+    return status, body
+
+
+def get_puzzle(rows, columns, difficulty=None, address=DEFAULT_ADDRESS):
+    """Return an ipuz dictionary from the daemon or None if it has none."""
+    line = 'GET %d %d' % (rows, columns)
+    if difficulty is not None:
+        line += ' ' + difficulty
+    status, body = _request(line, address)
+    return json.loads(body) if status == 'OK' else None
+
+
+def get_stats(address=DEFAULT_ADDRESS):
+    """Return the daemon's metrics."""
+    return json.loads(_request('STATS', address)[1])
+
+
+def _parse_stock(option, opt, value, parser):
+    """Parse "ROWSxCOLUMNS[:DIFFICULTY]=COUNT" into parser.values.stock."""
+    try:
+        size, count = value.split('=')
+        size, _, difficulty = size.partition(':')
+        rows, columns = size.lower().split('x')
+        key = (int(rows), int(columns), difficulty or None)
+        parser.values.stock[key] = int(count)
+    except ValueError:
+        parser.error('Stocks look like 15x15:easy=20, not %r.' % value)
+
+
+def main(args):
+    parser = OptionParser()
+    parser.set_defaults(stock={})
+    parser.add_option('-s', '--stock', action='callback', type='string',
+                      callback=_parse_stock, metavar='ROWSxCOLUMNS[:LEVEL]=N',
+                      help='keep N puzzles of this size and difficulty')
+    parser.add_option('--host', dest='host', default=DEFAULT_ADDRESS[0])
+    parser.add_option('-p', '--port', dest='port', type='int',
+                      default=DEFAULT_ADDRESS[1])
+    parser.add_option('-n', '--processes', dest='processes', type='int')
+    parser.add_option('-a', '--api-key', dest='api_key')
+    parser.add_option('--lexicon', dest='lexicon_path')
+    parser.add_option('--word-index', dest='index_path')
+    parser.add_option('--letter-stats', dest='stats_path')
+    parser.add_option('-t', '--time-budget', dest='time_budget', type='float')
+    parser.add_option('-c', '--cache', dest='cache',
+                      metavar='SOCKET_PATH|HOST:PORT',
+                      help='ask this wordnikcache.py server before Wordnik')
+    options, args = parser.parse_args(args)
+    if not options.stock:
+        parser.error('At least one --stock must be given.')
+
+    cache_address = options.cache and parse_address(options.cache)
+    daemon = PuzzleDaemon(options.stock, (options.host, options.port),
+                          options.processes, options.api_key,
+                          options.lexicon_path, options.index_path,
+                          options.stats_path, options.time_budget,
+                          cache_address=cache_address)
+    print >> sys.stderr, 'Serving puzzles on %s:%d.' % daemon.server_address
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+
+"""
+Generation of very large puzzles (50x50 and up) by filling regions in parallel.
+
+A CrosswordPuzzle places one word at a time and looks at the whole grid for
+each, which gets slow well before print special sizes. Here the grid is cut
+into tiles of `region_size` squares on a side instead. Each tile is filled by
+a CrosswordPuzzle in a worker process, which only holds the tile and a halo of
+two squares around it:
+
+    * Letters and black squares already placed in the halo by neighbouring
+      tiles are copied in, so words can cross them and the worker's checks
+      see them.
+    * Empty halo squares are blacked out in the worker, so letters are only
+      written inside the tile.
+    * Words may run along letters in the first ring of the halo but no
+      further, so the squares next to every word and at its ends are within
+      the region the worker can see.
+
+Tiles are filled in four phases by the parity of their row and column. Tiles
+of the same phase are two tiles apart, so as long as tiles are at least
+MIN_REGION_SIZE squares on a side, nothing one worker changes is in another's
+region and they can be filled at the same time without conflicts. Between
+phases the master copies the placed words onto a plain character array of the
+whole grid, blacking out the squares at either end of each word like
+put_word_on_grid does. Only at the end is a CrosswordPuzzle of the full size
+built, numbered the standard way, so memory for Squares and spans is only
+needed for one region per worker until then.
+
+>>> puzzle = make_large_puzzle(50, 50, processes=8)
+>>> puzzle = make_large_puzzle(50, 50, wordnik=RandomWordnik(0))
+"""
+
+
+import multiprocessing
+import os
+import random
+import sys
+import traceback
+
+from crosswordnik import CrosswordPuzzle
+from difficulty import BandedIndex, check_difficulty
+from letterstats import LetterStats
+from lexicon import Lexicon
+
+
+DEFAULT_REGION_SIZE = 15
+MIN_REGION_SIZE = 4
+HALO = 2
+EMPTY = '.'
+BLACK = '#'
+
+# The longest word that starts a tile nobody has written in yet.
+SEED_WORD_LENGTH = 7
+
+
+class RegionError(Exception):
+    """Raised when a worker fails to fill a region."""
+
+
+def words_for_region(rows, columns):
+    """Return how many words to try to place in a `rows` X `columns` tile."""
+    return 2 * max(rows, columns)
+
+
+def regions(rows, columns, region_size):
+    """Return the tiles of the grid as (phase, top, left, bottom, right).
+
+    Bottom and right are exclusive. Tiles with the same phase don't touch.
+    """
+    tiles = []
+    for i, top in enumerate(range(0, rows, region_size)):
+        for j, left in enumerate(range(0, columns, region_size)):
+            tiles.append((2 * (i % 2) + j % 2, top, left,
+                          min(top + region_size, rows),
+                          min(left + region_size, columns)))
+    return tiles
+
+
+# Set in each worker process by _init_worker.
+_worker = {}
+
+
+def _init_worker(api_key, wordnik, lexicon_path, index_path, stats_path,
+                 difficulty, time_budget, validator):
+    """Load the word data once per worker process."""
+    # Placement messages from every worker would flood the log.
+    sys.stderr = open(os.devnull, 'w')
+    # Forked workers would otherwise all make the same random choices.
+    random.seed()
+    _worker['api_key'] = api_key
+    _worker['wordnik'] = wordnik
+    _worker['lexicon'] = lexicon_path and Lexicon.load(lexicon_path)
+    _worker['word_index'] = index_path and BandedIndex.load(index_path)
+    _worker['letter_stats'] = stats_path and LetterStats.load(stats_path)
+    _worker['difficulty'] = difficulty
+    _worker['time_budget'] = time_budget
+    _worker['validator'] = validator
+
+
+class _RegionPuzzle(CrosswordPuzzle):
+    """A CrosswordPuzzle that only places words within `bounds`.
+
+    `bounds` is (top, left, bottom, right), bottom and right exclusive.
+    """
+
+    bounds = None
+
+    def candidate_spans(self):
+        top, left, bottom, right = self.bounds
+        return [span for span in CrosswordPuzzle.candidate_spans(self)
+                if top <= span[0][0] and left <= span[0][1] and
+                   span[-1][0] < bottom and span[-1][1] < right]
+
+
+def _seed_word(puzzle, core):
+    """Place a word across the top of an empty tile. Return True if one is.
+
+    CrosswordPuzzle.place_first_word would put the Word of the Day in the
+    corner of every empty tile, so a random word of up to SEED_WORD_LENGTH
+    letters is searched for instead. It goes in the top row like the first
+    word of a puzzle, so the words built off it all hang down from it.
+    """
+    top, left, bottom, right = core
+    for length in range(min(right - left, SEED_WORD_LENGTH), 1, -1):
+        words = puzzle.search_words('?' * length)
+        if words:
+            word = random.choice(words)
+            puzzle.add_word(word['wordstring'],
+                            [(top, n) for n in range(left, left + length)])
+            return True
+    return False
+
+
+def _fill_region(task):
+    """Fill one tile in a worker. Return (words, error).
+
+    `task` is (top, left, cells, core): the position of the region (tile plus
+    halo) on the full grid, its squares as lists of letters, EMPTY and BLACK,
+    and the tile's (top, left, bottom, right) within the region. Each word is
+    (word, direction, m, n, clue) with (m, n) on the full grid.
+    """
+    top, left, cells, core = task
+    try:
+        puzzle = _RegionPuzzle(len(cells), len(cells[0]), _worker['api_key'],
+                               _worker['lexicon'], _worker['wordnik'],
+                               _worker['letter_stats'], _worker['difficulty'],
+                               _worker['word_index'], _worker['validator'])
+        grid = puzzle.grid
+        core_top, core_left, core_bottom, core_right = core
+        puzzle.bounds = (max(core_top - 1, 0), max(core_left - 1, 0),
+                         min(core_bottom + 1, grid.num_rows),
+                         min(core_right + 1, grid.num_columns))
+        for m, row in enumerate(cells):
+            for n, cell in enumerate(row):
+                if cell == BLACK:
+                    grid.blackout_square(m, n)
+                elif cell != EMPTY:
+                    grid.set_letter(m, n, cell)
+                elif not (core_top <= m < core_bottom and
+                          core_left <= n < core_right):
+                    grid.blackout_square(m, n)
+
+        word_count = words_for_region(core_bottom - core_top,
+                                      core_right - core_left)
+        # Words can only be built off letters within the bounds.
+        bounds_top, bounds_left, bounds_bottom, bounds_right = puzzle.bounds
+        seeded = any(cells[m][n] not in (EMPTY, BLACK)
+                     for m in range(bounds_top, bounds_bottom)
+                     for n in range(bounds_left, bounds_right))
+        if not seeded:
+            if not _seed_word(puzzle, core):
+                return [], None
+            word_count -= 1
+        puzzle.populate_puzzle(word_count, _worker['time_budget'])
+
+        starts = dict((sq.id_, (sq.m, sq.n)) for sq in grid
+                      if sq.id_ is not None)
+        words = []
+        for (id_, direction), (word, clue) in puzzle.clues.items():
+            m, n = starts[id_]
+            words.append((word, direction, top + m, left + n, clue))
+        return words, None
+    except Exception:
+        return [], traceback.format_exc()
+
+
+class LargeGrid(object):
+    """The letters and black squares of the full grid, one string each."""
+
+    def __init__(self, rows, columns):
+        self.num_rows = rows
+        self.num_columns = columns
+        self.cells = [EMPTY] * (rows * columns)
+        self.words = []  # (word, direction, m, n, clue) in placement order
+
+    def __getitem__(self, (m, n)):
+        return self.cells[m * self.num_columns + n]
+
+    def __setitem__(self, (m, n), cell):
+        self.cells[m * self.num_columns + n] = cell
+
+    def region(self, top, left, bottom, right):
+        """Return the squares from (top, left) up to (bottom, right) as rows."""
+        return [self.cells[m * self.num_columns + left:
+                           m * self.num_columns + right]
+                for m in range(top, bottom)]
+
+    def add_word(self, word, direction, m, n, clue):
+        """Write `word` starting at (m, n) and black out the squares at its ends.
+        """
+        dm, dn = (0, 1) if direction == 'ACROSS' else (1, 0)
+        for i, letter in enumerate(word):
+            cell = self[m + i * dm, n + i * dn]
+            assert cell in (EMPTY, letter), 'Regions overlapped.'
+            self[m + i * dm, n + i * dn] = letter
+        for (mm, nn) in ((m - dm, n - dn),
+                         (m + len(word) * dm, n + len(word) * dn)):
+            if (0 <= mm < self.num_rows and 0 <= nn < self.num_columns and
+                    self[mm, nn] == EMPTY):
+                self[mm, nn] = BLACK
+        self.words.append((word, direction, m, n, clue))
+
+    def to_puzzle(self, api_key=None, wordnik=None):
+        """Return a finalized CrosswordPuzzle holding the grid's words.
+
+        The clues are numbered the standard way, left to right and top to
+        bottom, rather than in the order the words were placed.
+        """
+        puzzle = CrosswordPuzzle(self.num_rows, self.num_columns, api_key,
+                                 wordnik=wordnik)
+        grid = puzzle.grid
+        for m in range(self.num_rows):
+            for n in range(self.num_columns):
+                cell = self[m, n]
+                if cell == BLACK:
+                    grid.blackout_square(m, n)
+                elif cell != EMPTY:
+                    grid.set_letter(m, n, cell)
+
+        for word, direction, m, n, clue in sorted(
+                self.words, key=lambda w: (w[2], w[3], w[1])):
+            id_ = grid[m, n].id_
+            if id_ is None:
+                id_ = puzzle._current_sq_id
+                puzzle._current_sq_id += 1
+                grid.set_id(m, n, id_)
+            puzzle.store_clue(word, id_, direction, clue)
+        puzzle.finalize()
+        return puzzle
+
+
+def make_large_puzzle(rows, columns, region_size=DEFAULT_REGION_SIZE,
+                      processes=None, api_key=None, wordnik=None,
+                      lexicon_path=None, index_path=None, stats_path=None,
+                      difficulty=None, time_budget=None, validator=None):
+    """Return a `rows` by `columns` puzzle filled region by region.
+
+    `processes` worker processes fill the regions. The Wordnik client is
+    made from `api_key` in each worker, or `wordnik` (which must be picklable)
+    is used instead. The paths are files made by lexicon.py, difficulty.py and
+    letterstats.py, loaded by each worker. `time_budget` limits the seconds
+    spent on each region. A validator.WordValidator passed in as `validator`
+    (which must be picklable too) keeps the workers from placing words that
+    leave runs of letters that aren't words.
+    """
+    check_difficulty(difficulty)
+    if region_size < MIN_REGION_SIZE:
+        raise ValueError('Regions must be at least %d squares on a side.' %
+                         MIN_REGION_SIZE)
+    grid = LargeGrid(rows, columns)
+    tiles = regions(rows, columns, region_size)
+    pool = multiprocessing.Pool(
+        processes, _init_worker,
+        (api_key, wordnik, lexicon_path, index_path, stats_path, difficulty,
+         time_budget, validator))
+    try:
+        for phase in range(4):
+            tasks = []
+            for tile_phase, top, left, bottom, right in tiles:
+                if tile_phase != phase:
+                    continue
+                region_top = max(top - HALO, 0)
+                region_left = max(left - HALO, 0)
+                region_bottom = min(bottom + HALO, rows)
+                region_right = min(right + HALO, columns)
+                tasks.append((region_top, region_left,
+                              grid.region(region_top, region_left,
+                                          region_bottom, region_right),
+                              (top - region_top, left - region_left,
+                               bottom - region_top, right - region_left)))
+            for words, error in pool.map(_fill_region, tasks):
+                if error is not None:
+                    raise RegionError(error)
+                for word in words:
+                    grid.add_word(*word)
+    finally:
+        pool.terminate()
+    return grid.to_puzzle(api_key, wordnik)
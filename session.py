@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""
+Lightweight player sessions for finished crossword puzzles.
+
+A finished puzzle is frozen into a Solution, which holds the correct letters as
+a flat, immutable string and never changes again. Every player gets their own
+PlayerSession, which is just a bytearray of the player's entries laid over the
+shared Solution plus a running count of correctly filled squares. That makes
+checking for completion O(1) and lets many sessions share one solution.
+
+>>> solution = Solution.from_puzzle(puzzle)
+>>> session = PlayerSession(solution)
+>>> session.enter(0, 0, 'c')
+>>> session.enter(0, 1, 'x')
+>>> session.check_word(1, 'ACROSS')
+[(0, 1)]
+"""
+
+
+# The byte used in the solution for blacked out squares and in the entries for
+# squares the player hasn't filled in yet.
+EMPTY = '\0'
+
+
+class Solution(object):
+    """The immutable answer key of a finished puzzle.
+
+    `letters` is a string with one character per square in row-major order,
+    where blacked out squares are EMPTY. `words` maps the clue keys used in
+    CrosswordPuzzle.clues, e.g. (1, 'DOWN'), to the tuple of flat indexes of
+    the squares the word occupies.
+    """
+
+    def __init__(self, num_rows, num_columns, letters, words):
+        assert len(letters) == num_rows * num_columns
+        self.num_rows = num_rows
+        self.num_columns = num_columns
+        self.letters = letters
+        self.words = words
+        self.num_letters = len(letters) - letters.count(EMPTY)
+
+    @classmethod
+    def from_puzzle(cls, puzzle):
+        """Return the Solution for a populated CrosswordPuzzle."""
+        grid = puzzle.grid
+        letters = ''.join(EMPTY if sq.letter is None else str(sq.letter).lower()
+                          for sq in grid)
+
+        starts = {}
+        for sq in grid:
+            if sq.id_ is not None:
+                starts[sq.id_] = (sq.m, sq.n)
+
+        words = {}
+        for (id_, direction), (word, _) in puzzle.clues.items():
+            m, n = starts[id_]
+            if direction == 'ACROSS':
+                span = [(m, n + i) for i in range(len(word))]
+            else:
+                span = [(m + i, n) for i in range(len(word))]
+            words[id_, direction] = tuple(m * grid.num_columns + n
+                                          for (m, n) in span)
+        return cls(grid.num_rows, grid.num_columns, letters, words)
+
+    def index(self, m, n):
+        """Return the flat index of the square at (`m`, `n`)."""
+        if not (0 <= m < self.num_rows and 0 <= n < self.num_columns):
+            raise IndexError('(%d, %d) is not on the grid.' % (m, n))
+        return m * self.num_columns + n
+
+    def position(self, index):
+        """Return the (m, n) of the square at flat index `index`."""
+        return divmod(index, self.num_columns)
+
+    def letter(self, m, n):
+        """Return the correct letter at (`m`, `n`) or None if blacked out."""
+        letter = self.letters[self.index(m, n)]
+        return None if letter == EMPTY else letter
+
+
+class PlayerSession(object):
+    """One player's entries laid over a shared Solution.
+
+    Only the bytearray of entries and a counter are stored per session, so a
+    session costs about one byte per square.
+    """
+
+    def __init__(self, solution):
+        self.solution = solution
+        self.entries = bytearray(len(solution.letters))
+        self.num_correct = 0
+
+    @property
+    def is_completed(self):
+        """Return True if every letter square holds the correct letter."""
+        return self.num_correct == self.solution.num_letters
+
+    def entry(self, m, n):
+        """Return the player's entry at (`m`, `n`) or None if it is empty."""
+        entry = self.entries[self.solution.index(m, n)]
+        return None if entry == 0 else chr(entry)
+
+    def enter(self, m, n, letter):
+        """Set the player's entry at (`m`, `n`) to `letter`.
+
+        Passing None for `letter` clears the square.
+        """
+        i = self.solution.index(m, n)
+        if self.solution.letters[i] == EMPTY:
+            raise ValueError('Cannot enter a letter in a blacked out square.')
+        if letter is not None and len(str(letter)) != 1:
+            raise ValueError('Enter a single letter, not %r.' % (letter,))
+        self._set(i, EMPTY if letter is None else str(letter).lower())
+
+    def check_word(self, id_, direction):
+        """Return the (m, n) of filled squares in the word that are wrong."""
+        letters = self.solution.letters
+        return [self.solution.position(i)
+                for i in self.solution.words[id_, direction]
+                if self.entries[i] != 0 and chr(self.entries[i]) != letters[i]]
+
+    def reveal_word(self, id_, direction):
+        """Fill in the correct letters for the word."""
+        for i in self.solution.words[id_, direction]:
+            self._set(i, self.solution.letters[i])
+
+    def _set(self, i, letter):
+        """Store `letter` at flat index `i` and update the correct count."""
+        correct = self.solution.letters[i]
+        if self.entries[i] != 0 and chr(self.entries[i]) == correct:
+            self.num_correct -= 1
+        self.entries[i] = ord(letter)
+        if letter == correct:
+            self.num_correct += 1
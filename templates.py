@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+"""
+Precomputed layouts of black squares ("templates") for crossword grids.
+
+Conventional crosswords are laid out before any letters are chosen. Their
+black squares are symmetric under a half turn of the grid, the white squares
+are all connected, every word is at least three letters long and between about
+an eighth and a sixth of the squares are black. Finding layouts like that is slow, so
+it's done offline and the results are stored in a TemplateLibrary. The library
+is indexed by the number of black squares and by the lengths of the slots.
+
+    python templates.py templates.lib --size 15 --size 21 --count 500
+
+>>> library = TemplateLibrary.load('templates.lib')
+>>> template = library.choose(15, 15)
+>>> puzzle = CrosswordPuzzle(15, 15)
+>>> puzzle.apply_template(template)
+>>> puzzle.populate_puzzle(80)
+
+The library file is a single marshal dump, index included, so loading it is
+one read.
+"""
+
+
+from collections import deque
+import itertools
+import marshal
+import math
+from optparse import OptionParser
+import random
+import sys
+
+
+BLACK = '#'
+WHITE = '.'
+VERSION = 1
+MIN_WORD_LENGTH = 3
+MIN_BLACK_RATIO = 0.12
+MAX_BLACK_RATIO = 0.16
+COMMON_SIZES = (5, 7, 9, 11, 13, 15, 21)
+
+# Sizes with at most this many symmetric pairs of squares are searched
+# exhaustively; larger sizes are sampled at random.
+EXHAUSTIVE_PAIRS = 16
+
+
+class TemplateFormatError(Exception):
+    """Raised when a file isn't a template library."""
+
+
+class Template(object):
+    """An immutable layout of black and white squares."""
+
+    def __init__(self, rows, columns, cells):
+        """`cells` has a BLACK or WHITE character per square, row by row."""
+        assert len(cells) == rows * columns
+        self.rows = rows
+        self.columns = columns
+        self.cells = cells
+
+    def __str__(self):
+        return '\n'.join(self.cells[m * self.columns:(m + 1) * self.columns]
+                         for m in range(self.rows))
+
+    def __eq__(self, other):
+        return (isinstance(other, Template) and
+                (self.rows, self.columns, self.cells) ==
+                (other.rows, other.columns, other.cells))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.rows, self.columns, self.cells))
+
+    def is_black(self, m, n):
+        return self.cells[m * self.columns + n] == BLACK
+
+    @property
+    def num_black(self):
+        return self.cells.count(BLACK)
+
+    def slots(self):
+        """Return the spans of the runs of two or more white squares.
+
+        Each span is a tuple of (m, n) pairs, like the spans of a Grid.
+        """
+        lines = [[(m, n) for n in range(self.columns)]
+                 for m in range(self.rows)]
+        lines.extend([(m, n) for m in range(self.rows)]
+                     for n in range(self.columns))
+        slots = []
+        for line in lines:
+            run = []
+            for sq in line + [None]:
+                if sq is not None and not self.is_black(*sq):
+                    run.append(sq)
+                    continue
+                if len(run) > 1:
+                    slots.append(tuple(run))
+                run = []
+        return slots
+
+    @property
+    def profile(self):
+        """Return the slot lengths, longest first."""
+        return tuple(sorted((len(slot) for slot in self.slots()),
+                            reverse=True))
+
+
+def _run_lengths_ok(cells, rows, columns, min_length):
+    """Return True if every run of white squares is at least `min_length`."""
+    lines = [cells[m * columns:(m + 1) * columns] for m in range(rows)]
+    lines.extend(cells[n::columns] for n in range(columns))
+    for line in lines:
+        for run in line.split(BLACK):
+            if 0 < len(run) < min_length:
+                return False
+    return True
+
+
+def _connected(cells, rows, columns):
+    """Return True if the white squares form a single connected region."""
+    whites = [i for i, c in enumerate(cells) if c == WHITE]
+    if not whites:
+        return False
+    seen = set([whites[0]])
+    queue = deque([whites[0]])
+    while queue:
+        i = queue.popleft()
+        m, n = divmod(i, columns)
+        for dm, dn in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            mm, nn = m + dm, n + dn
+            j = mm * columns + nn
+            if (0 <= mm < rows and 0 <= nn < columns and j not in seen and
+                    cells[j] == WHITE):
+                seen.add(j)
+                queue.append(j)
+    return len(seen) == len(whites)
+
+
+def is_valid(cells, rows, columns, min_length=MIN_WORD_LENGTH):
+    """Return True if `cells` is symmetric, connected and has no short words."""
+    return (cells == cells[::-1] and
+            _run_lengths_ok(cells, rows, columns, min_length) and
+            _connected(cells, rows, columns))
+
+
+def _symmetric_pairs(rows, columns):
+    """Return the squares as (i, j) pairs that map onto each other."""
+    size = rows * columns
+    return [(i, size - 1 - i) for i in range((size + 1) // 2)]
+
+
+def _blacken(cells, pairs):
+    cells = list(cells)
+    for pair in pairs:
+        for i in pair:
+            cells[i] = BLACK
+    return ''.join(cells)
+
+
+def generate_templates(rows, columns, count, max_black_ratio=MAX_BLACK_RATIO,
+                       min_length=MIN_WORD_LENGTH, seed=None, attempts=None,
+                       min_black_ratio=MIN_BLACK_RATIO):
+    """Return up to `count` distinct valid templates of the given size.
+
+    Between `min_black_ratio` and `max_black_ratio` of the squares are black,
+    like in published grids. Small sizes are enumerated exhaustively. For
+    larger ones each attempt starts from an all white grid and blacks out
+    random symmetric pairs of squares, keeping each pair only if the grid
+    stays valid, until the black squares reach a random share in that range.
+    Attempts that get stuck short of `min_black_ratio` are dropped.
+    """
+    pairs = _symmetric_pairs(rows, columns)
+    max_black = int(rows * columns * max_black_ratio)
+    min_black = min(int(math.ceil(rows * columns * min_black_ratio)),
+                    max_black)
+    empty = WHITE * (rows * columns)
+
+    if len(pairs) <= EXHAUSTIVE_PAIRS:
+        found = []
+        for k in range(len(pairs) + 1):
+            for chosen in itertools.combinations(pairs, k):
+                cells = _blacken(empty, chosen)
+                if (min_black <= cells.count(BLACK) <= max_black and
+                        is_valid(cells, rows, columns, min_length)):
+                    found.append(Template(rows, columns, cells))
+                    if len(found) == count:
+                        return found
+        return found
+
+    rand = random.Random(seed)
+    found = set()
+    for attempt in xrange(attempts or count * 20):
+        target = rand.randint(min_black, max_black)
+        cells = empty
+        candidates = pairs[:]
+        rand.shuffle(candidates)
+        for pair in candidates:
+            if cells.count(BLACK) >= target:
+                break
+            trial = _blacken(cells, [pair])
+            if (trial.count(BLACK) <= max_black and
+                    is_valid(trial, rows, columns, min_length)):
+                cells = trial
+        if cells.count(BLACK) < min_black:
+            continue
+        found.add(Template(rows, columns, cells))
+        if len(found) == count:
+            break
+    return sorted(found, key=lambda t: (t.num_black, t.cells))
+
+
+class TemplateLibrary(object):
+    """Templates indexed by size, black square count and slot profile."""
+
+    def __init__(self, sizes=None):
+        # {(rows, columns): {'cells': [...], 'by_black': {count: [ids]},
+        #                    'by_profile': {profile: [ids]}}}
+        self.sizes = sizes or {}
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            try:
+                data = marshal.load(f)
+            except (EOFError, ValueError, TypeError):
+                raise TemplateFormatError('Not a template library.')
+        if not isinstance(data, dict) or data.get('version') != VERSION:
+            raise TemplateFormatError('Not a template library.')
+        return cls(data['sizes'])
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            marshal.dump({'version': VERSION, 'sizes': self.sizes}, f)
+
+    def add(self, template):
+        """Add `template` to the library unless it's already there."""
+        size = self.sizes.setdefault((template.rows, template.columns),
+                                     {'cells': [], 'by_black': {},
+                                      'by_profile': {}})
+        if template.cells in size['cells']:
+            return
+        id_ = len(size['cells'])
+        size['cells'].append(template.cells)
+        size['by_black'].setdefault(template.num_black, []).append(id_)
+        size['by_profile'].setdefault(template.profile, []).append(id_)
+
+    def find(self, rows, columns, num_black=None, profile=None):
+        """Return the templates of the size matching the optional filters."""
+        size = self.sizes.get((rows, columns))
+        if size is None:
+            return []
+        ids = set(range(len(size['cells'])))
+        if num_black is not None:
+            ids &= set(size['by_black'].get(num_black, ()))
+        if profile is not None:
+            ids &= set(size['by_profile'].get(tuple(profile), ()))
+        return [Template(rows, columns, size['cells'][id_])
+                for id_ in sorted(ids)]
+
+    def choose(self, rows, columns, num_black=None, profile=None, rand=random):
+        """Return a random matching template or None if there isn't one."""
+        templates = self.find(rows, columns, num_black, profile)
+        return rand.choice(templates) if templates else None
+
+
+def main(args):
+    parser = OptionParser(usage='%prog OUTPUT_FILE [options]')
+    parser.add_option('-s', '--size', dest='sizes', type='int',
+                      action='append', help='make SIZE x SIZE templates')
+    parser.add_option('-c', '--count', dest='count', type='int', default=100,
+                      help='number of templates per size')
+    parser.add_option('--seed', dest='seed', type='int')
+    options, args = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error('An output file must be specified.')
+
+    library = TemplateLibrary()
+    for size in options.sizes or COMMON_SIZES:
+        templates = generate_templates(size, size, options.count,
+                                       seed=options.seed)
+        for template in templates:
+            library.add(template)
+        print >> sys.stderr, '%dx%d: %d templates' % (size, size,
+                                                       len(templates))
+    library.save(args[0])
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -1,10 +1,968 @@
+"""
+Tests for the puzzle generator. They run offline: words come from WORDS
+through ListWordnik instead of from the Wordnik API.
+
+    py.test test.py
+"""
+
+
+import os
+import random
+import re
+import shutil
+import socket
+import SocketServer
+import string
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+
+import pytest
+
+import crosswordnik
+from crosswordnik import (ALL_LETTERS, CrosswordPuzzle, Grid, PuzzleInPlay,
+                          STOPPED_TIME_BUDGET, STOPPED_WORD_COUNT)
+from difficulty import EASY, HARD
+import export
+from letterstats import LetterStats
+from lexicon import Lexicon, LexiconFormatError, letter_mask
+import puzzlepool
+from puzzlepool import PuzzleStock
+from regions import make_large_puzzle
+import templates
+from validator import WordValidator
+from wordnik import Wordnik
+from wordnikcache import (CacheClient, CacheServer, LookupCache,
+                          parse_address)
+
+
+WORDS = '''
+able ace age air also any are arm ask awe back ball bar bay bed best
+bill bit boat book bow bread brown buy call can card case cause chart
+city clear cod cook corn could cow crow cup dark dead deep die do done
+down dress drop dust ear east edge elm era ever eye fair farm fear feet
+few fight fine first five fly food form free front fun gas gel gift
+give go gone grass green grow had hall happy hat he heart held hen hero
+hill his hold hope hour hug hunt inch iron ivy jaw jog jot keep key
+kind kit know lady lap late lay learn leg lid lift line list long lost
+love mad main many mat meat met mind mob more much must name neck net
+news night noise nor note oak ocean often once open order out own paint
+pan part past pay pen pie pin plan ply pool post press pull push quick
+rag ran raw read red rice ride ring river rod room rose row rule rush
+safe sail sand save sea seed send seven share shoe shot shy sign sink
+sit skin slow smell so soft son sort south space spell spy start step
+stone storm sugar sure table take tan tax team test the then they thing
+those time tip today ton took tot town trade trip tub two until urn vat
+visit wag wall warm watch wax wear well west wheel which who wife will
+wing wish woe won word world wrong yap year yew zap
+'''.split()
+
+
+class ListWordnik(object):
+    """Stand-in for wordnik.Wordnik that searches a list of words.
+
+    Earlier words in the list get higher corpus counts.
+    """
+
+    def __init__(self, words=WORDS, word_of_the_day='heart'):
+        self.words = words
+        self.counts = dict((word, len(words) - i)
+                           for i, word in enumerate(words))
+        self.wotd = word_of_the_day
+        self.timeout = None
+        self.searches = 0
+
+    def word_of_the_day(self):
+        return {'wordstring': self.wotd}
+
+    def word_search(self, query, max_length=None, min_corpus_count=None,
+                    max_corpus_count=None, **kwargs):
+        self.searches += 1
+        pattern = re.compile('^%s$' % query.replace('?', '.'))
+        return [{'wordstring': word, 'count': self.counts[word]}
+                for word in self.words if pattern.match(word) and
+                (min_corpus_count is None or
+                 self.counts[word] >= min_corpus_count) and
+                (max_corpus_count is None or
+                 self.counts[word] <= max_corpus_count)]
+
+    def definitions(self, word, **kwargs):
+        return [{'text': 'The word %s.' % word}]
+
+
+def make_offline_puzzle(rows=10, columns=10, num_words=10, **kwargs):
+    """Return a populated puzzle whose words come from WORDS."""
+    random.seed(0)
+    puzzle = CrosswordPuzzle(rows, columns, wordnik=ListWordnik(), **kwargs)
+    puzzle.populate_puzzle(num_words)
+    return puzzle
 
-from crosswordnik import make_puzzle
 
 class TestCrossword(object):
     def setup(self):
-        puzzle = make_puzzle(10, 10, 10) 
+        self.validator = WordValidator.from_words(WORDS)
+        self.puzzle = make_offline_puzzle(
+            lexicon=Lexicon.from_words(WORDS), validator=self.validator)
 
-    test_words(self):
+    def test_words(self):
         """Test whether all spans of letters are in fact words."""
-        pass
+        assert len(self.puzzle.clues) > 1
+        assert self.validator.audit_puzzle(self.puzzle) == []
+
+    def test_clues_match_grid(self):
+        starts = dict((sq.id_, (sq.m, sq.n)) for sq in self.puzzle.grid
+                      if sq.id_ is not None)
+        for (id_, direction), (word, clue) in self.puzzle.clues.items():
+            m, n = starts[id_]
+            dm, dn = (0, 1) if direction == 'ACROSS' else (1, 0)
+            letters = [self.puzzle.grid[m + i * dm, n + i * dn].letter
+                       for i in range(len(word))]
+            assert ''.join(letters) == word
+
+
+class TestSession(object):
+    def setup(self):
+        self.puzzle = make_offline_puzzle()
+
+    def test_entries_complete_the_puzzle(self):
+        assert not self.puzzle.is_completed
+        for sq in self.puzzle.grid:
+            if sq.letter is not None:
+                self.puzzle.enter_from_user(sq.m, sq.n, sq.letter)
+        assert self.puzzle.is_completed
+
+    def test_adding_a_word_in_play_raises(self):
+        sq = next(sq for sq in self.puzzle.grid if sq.letter is not None)
+        self.puzzle.enter_from_user(sq.m, sq.n, sq.letter)
+        try:
+            self.puzzle.add_word('at', [(0, 0), (0, 1)])
+        except PuzzleInPlay:
+            pass
+        else:
+            assert False, 'PuzzleInPlay was not raised.'
+        assert self.puzzle.session.entry(sq.m, sq.n) == sq.letter
+
+    def test_reading_the_session_leaves_the_puzzle_open(self):
+        puzzle = CrosswordPuzzle(10, 10, wordnik=ListWordnik())
+        assert puzzle.is_completed
+        assert puzzle.populate_puzzle(5) == 5
+        assert not puzzle.is_completed
+
+    def test_entering_more_than_a_letter_raises(self):
+        sq = next(sq for sq in self.puzzle.grid if sq.letter is not None)
+        try:
+            self.puzzle.enter_from_user(sq.m, sq.n, 'ab')
+        except ValueError:
+            pass
+        else:
+            assert False, 'ValueError was not raised.'
+        assert self.puzzle.session.entry(sq.m, sq.n) is None
+
+
+class NoWordOfTheDayWordnik(ListWordnik):
+    """A word source whose Word of the Day must not be asked for."""
+
+    def word_of_the_day(self):
+        assert False, 'The Word of the Day was asked for.'
+
+
+class TestFirstWord(object):
+    def test_difficulty_searches_for_the_first_word(self):
+        puzzle = CrosswordPuzzle(6, 6, wordnik=NoWordOfTheDayWordnik(),
+                                 difficulty=HARD)
+        word = puzzle.place_first_word()
+        assert word in WORDS and len(word) <= 6
+        assert ''.join(puzzle.grid[0, n].letter
+                       for n in range(len(word))) == word
+
+    def test_no_word_of_the_difficulty(self):
+        puzzle = CrosswordPuzzle(6, 6, wordnik=NoWordOfTheDayWordnik(),
+                                 difficulty=EASY)
+        assert puzzle.place_first_word() is None
+
+    def test_word_of_the_day_without_a_difficulty(self):
+        puzzle = CrosswordPuzzle(6, 6, wordnik=ListWordnik())
+        assert puzzle.place_first_word() == 'heart'
+
+
+class TimeoutlessWordnik(ListWordnik):
+    """A word source with Wordnik's methods but no timeout attribute."""
+
+    def __init__(self):
+        ListWordnik.__init__(self)
+        del self.timeout
+
+
+class TestTimeBudget(object):
+    def test_word_count_stops_the_run(self):
+        puzzle = make_offline_puzzle(num_words=3)
+        assert len(puzzle.clues) == 3
+        assert puzzle.stop_reason == STOPPED_WORD_COUNT
+
+    def test_no_budget_leaves_the_timeout_alone(self):
+        puzzle = CrosswordPuzzle(10, 10, wordnik=TimeoutlessWordnik())
+        puzzle.populate_puzzle(5)
+        assert len(puzzle.clues) == 5
+
+    def test_budget_without_a_timeout_attribute(self):
+        puzzle = CrosswordPuzzle(10, 10, wordnik=TimeoutlessWordnik())
+        puzzle.populate_puzzle(5, time_budget=60)
+        assert len(puzzle.clues) == 5
+        assert not hasattr(puzzle.wordnik, 'timeout')
+
+    def test_budget_restores_the_timeout(self):
+        wordnik = ListWordnik()
+        wordnik.timeout = 7
+        puzzle = CrosswordPuzzle(10, 10, wordnik=wordnik)
+        puzzle.populate_puzzle(5, time_budget=60)
+        assert wordnik.timeout == 7
+
+    def test_spent_budget_keeps_placed_words(self):
+        puzzle = CrosswordPuzzle(10, 10, wordnik=ListWordnik())
+        puzzle.populate_puzzle(5, time_budget=0)
+        assert puzzle.stop_reason == STOPPED_TIME_BUDGET
+        assert puzzle.clues == {}
+
+
+class SlowEmptyIndex(object):
+    """A word index that takes a while to find nothing."""
+
+    def __init__(self):
+        self.searches = 0
+
+    def search(self, query, difficulty=None):
+        self.searches += 1
+        time.sleep(0.02)
+        return []
+
+
+class TestLocalSearchBudget(object):
+    def test_placement_stops_at_the_deadline(self):
+        index = SlowEmptyIndex()
+        puzzle = CrosswordPuzzle(10, 10, wordnik=ListWordnik(),
+                                 word_index=index)
+        puzzle.place_first_word('heart')
+        puzzle.populate_puzzle(5, time_budget=0.1)
+        assert puzzle.stop_reason == STOPPED_TIME_BUDGET
+        assert index.searches < 10
+
+
+class TestLexicon(object):
+    def setup(self):
+        self.lexicon = Lexicon.from_words(WORDS)
+        self.words = set(WORDS)
+        rand = random.Random(0)
+        # Every substring of the words plus some random strings.
+        self.fragments = set(word[i:j] for word in WORDS
+                             for i in range(len(word))
+                             for j in range(i + 1, len(word) + 1))
+        self.fragments.update(
+            ''.join(rand.choice(string.ascii_lowercase)
+                    for i in range(rand.randint(1, 4)))
+            for k in range(500))
+
+    def test_words(self):
+        for fragment in self.fragments:
+            assert self.lexicon.is_word(fragment) == (fragment in self.words)
+        assert 'HEART' in self.lexicon
+
+    def test_prefixes_and_suffixes(self):
+        for fragment in self.fragments:
+            assert self.lexicon.is_prefix(fragment) == any(
+                word.startswith(fragment) for word in self.words)
+            assert self.lexicon.is_suffix(fragment) == any(
+                word.endswith(fragment) for word in self.words)
+
+    def test_iteration_is_sorted(self):
+        assert list(self.lexicon) == sorted(self.words)
+
+    def test_feasible_letters(self):
+        rand = random.Random(1)
+        fragments = sorted(self.fragments) + ['']
+        for i in range(300):
+            before, after = rand.choice(fragments), rand.choice(fragments)
+            for open_before in (False, True):
+                for open_after in (False, True):
+                    expected = set(
+                        letter for letter in string.ascii_lowercase
+                        if self.lexicon.is_feasible(before + letter + after,
+                                                    open_before, open_after))
+                    assert self.lexicon.feasible_letters(
+                        before, after, open_before, open_after) == expected
+
+    def test_file_round_trip(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'words.dawg')
+            Lexicon.build(WORDS, path)
+            assert list(Lexicon.load(path)) == sorted(self.words)
+            with open(path, 'wb') as f:
+                f.write('not a lexicon')
+            try:
+                Lexicon.load(path)
+            except LexiconFormatError:
+                pass
+            else:
+                assert False, 'LexiconFormatError was not raised.'
+        finally:
+            shutil.rmtree(directory)
+
+
+def random_grid(rand, rows, columns, words=WORDS):
+    """Return a Grid with some of `words` written on it and black squares."""
+    grid = Grid(rows, columns)
+    for i in range(rows * columns // 4):
+        m, n = rand.randrange(rows), rand.randrange(columns)
+        if rand.random() < 0.2:
+            if grid[m, n].letter is None:
+                grid.blackout_square(m, n)
+            continue
+        word = rand.choice(words)
+        dm, dn = rand.choice(((0, 1), (1, 0)))
+        cells = [(m + i * dm, n + i * dn) for i in range(len(word))]
+        if all(grid.are_valid_coordinates(*cell) and
+               not grid[cell].blacked_out and
+               grid[cell].letter in (None, letter)
+               for cell, letter in zip(cells, word)):
+            for (mm, nn), letter in zip(cells, word):
+                grid.set_letter(mm, nn, letter)
+    return grid
+
+
+def grid_state(grid):
+    """Return everything the squares of `grid` hold."""
+    return [(sq.letter, sq.blacked_out, sq.id_, sq.across_check,
+             sq.down_check) for sq in grid]
+
+
+class TestFork(object):
+    def setup(self):
+        self.lexicon = Lexicon.from_words(WORDS)
+        # populate_puzzle would finalize the puzzle, so words are added here.
+        random.seed(0)
+        self.puzzle = CrosswordPuzzle(10, 10, lexicon=self.lexicon,
+                                      wordnik=ListWordnik())
+        self.puzzle.place_first_word()
+        for i in range(3):
+            self.puzzle.find_and_add_a_word()
+
+    def test_grid_fork_is_independent(self):
+        grid = Grid(5, 5, self.lexicon)
+        grid.set_letter(0, 0, 'a')
+        before = grid_state(grid)
+        fork = grid.fork()
+        fork.set_letter(1, 1, 'b')
+        fork.blackout_square(4, 4)
+        assert grid_state(grid) == before
+        grid.set_letter(2, 2, 'c')
+        assert fork[2, 2].letter is None
+        assert fork[1, 1].letter == 'b' and grid[1, 1].letter is None
+        # Rows neither grid changed are still shared.
+        assert fork.grid[3] is grid.grid[3]
+
+    def test_grid_undo(self):
+        rand = random.Random(0)
+        for i in range(20):
+            grid = random_grid(rand, 6, 6)
+            grid.lexicon = self.lexicon
+            before = grid_state(grid)
+            mark = grid.mark()
+            changed = random_grid(rand, 6, 6)
+            for sq in changed:
+                if grid[sq.m, sq.n].blacked_out:
+                    continue
+                if sq.blacked_out and grid[sq.m, sq.n].letter is None:
+                    grid.blackout_square(sq.m, sq.n)
+                elif sq.letter is not None:
+                    grid.set_letter(sq.m, sq.n, sq.letter)
+            grid.undo(mark)
+            assert grid_state(grid) == before
+
+    def test_puzzle_fork_is_independent(self):
+        before = (grid_state(self.puzzle.grid), dict(self.puzzle.clues))
+        fork = self.puzzle.fork()
+        for i in range(3):
+            assert fork.find_and_add_a_word() is not None
+        assert len(fork.clues) == len(self.puzzle.clues) + 3
+        assert (grid_state(self.puzzle.grid), self.puzzle.clues) == before
+        assert self.puzzle.find_and_add_a_word() is not None
+        assert len(fork.clues) == len(self.puzzle.clues) + 2
+
+    def test_rollback(self):
+        before = (grid_state(self.puzzle.grid), dict(self.puzzle.clues))
+        snapshot = self.puzzle.snapshot()
+        added = [self.puzzle.find_and_add_a_word() for i in range(3)]
+        assert None not in added
+        self.puzzle.rollback(snapshot)
+        assert (grid_state(self.puzzle.grid), self.puzzle.clues) == before
+        # The same words are found again from the restored state.
+        assert [self.puzzle.find_and_add_a_word()
+                for i in range(3)] == added
+
+    def test_rollback_of_a_fork(self):
+        fork = self.puzzle.fork()
+        snapshot = fork.snapshot()
+        before = (grid_state(fork.grid), dict(fork.clues))
+        fork.find_and_add_a_word()
+        fork.rollback(snapshot)
+        assert (grid_state(fork.grid), fork.clues) == before
+        assert fork.clues is not self.puzzle.clues
+
+
+class TestLongerRuns(object):
+    """A span ending next to a letter mustn't take a word that the letter
+    would extend, even into another word: the clue would be for the word
+    while the grid holds the longer run."""
+
+    def setup(self):
+        self.lexicon = Lexicon.from_words(WORDS)
+        self.grid = Grid(3, 5, self.lexicon)
+        self.grid.set_letter(0, 2, 'n')
+        self.span = [(0, 0), (0, 1)]
+
+    def test_placement_is_infeasible(self):
+        assert not self.grid.placement_is_feasible('he', self.span,
+                                                   self.lexicon)
+        assert not self.grid.placement_is_feasible(
+            'he', self.span, Lexicon.from_words(WORDS))
+
+    def test_validator_reports_the_run(self):
+        validator = WordValidator.from_words(WORDS)
+        assert validator.check_placement(self.grid, 'he', self.span) == [
+            (((0, 0), (0, 1), (0, 2)), 'hen')]
+
+
+class TestValidator(object):
+    def setup(self):
+        self.validator = WordValidator.from_words(['cat', 'dog', 'ad', 'to'])
+        self.grid = Grid(2, 5)
+        for n, letter in enumerate('cat'):
+            self.grid.set_letter(0, n, letter)
+
+    def test_overlapping_parallel_word(self):
+        span = [(1, 2), (1, 3), (1, 4)]
+        assert self.validator.check_placement(self.grid, 'dog', span) == [
+            (((0, 2), (1, 2)), 'td')]
+
+    def test_parallel_word_making_words(self):
+        assert self.validator.check_placement(self.grid, 'do',
+                                              [(1, 1), (1, 2)]) == []
+
+
+class TestCrossChecks(object):
+    def setup(self):
+        self.lexicon = Lexicon.from_words(WORDS)
+        # The same words, but not the grid's lexicon, so the feasibility
+        # checks walk the runs instead of reading the cross-checks.
+        self.other_lexicon = Lexicon.from_words(WORDS)
+
+    def recomputed_checks(self, grid):
+        """Return every cross-check of `grid` worked out from scratch."""
+        checks = {}
+        for sq in grid:
+            if sq.letter is not None or sq.blacked_out:
+                continue
+            for direction in ('ACROSS', 'DOWN'):
+                before, after, open_before, open_after = grid.get_neighbours(
+                    sq.m, sq.n, direction)
+                if not before and not after:
+                    mask = ALL_LETTERS
+                else:
+                    mask = letter_mask(self.lexicon.feasible_letters(
+                        before, after, open_before, open_after))
+                checks[sq.m, sq.n, direction] = mask
+        return checks
+
+    def checks(self, grid):
+        return dict(((sq.m, sq.n, direction),
+                     grid.cross_check(sq.m, sq.n, direction))
+                    for sq in grid
+                    if sq.letter is None and not sq.blacked_out
+                    for direction in ('ACROSS', 'DOWN'))
+
+    def changes(self, rand, grid, count):
+        """Set random letters and black out random squares of `grid`."""
+        for i in range(count):
+            m, n = rand.randrange(grid.num_rows), rand.randrange(
+                grid.num_columns)
+            if grid[m, n].letter is None and not grid[m, n].blacked_out:
+                if rand.random() < 0.7:
+                    grid.set_letter(m, n, rand.choice('aeioustrnlch'))
+                else:
+                    grid.blackout_square(m, n)
+                yield
+
+    def test_incremental_checks_match_a_recompute(self):
+        rand = random.Random(0)
+        for i in range(10):
+            grid = Grid(7, 7, self.lexicon)
+            for change in self.changes(rand, grid, 30):
+                assert self.checks(grid) == self.recomputed_checks(grid)
+
+    def test_checks_survive_fork_and_undo(self):
+        rand = random.Random(1)
+        grid = Grid(7, 7, self.lexicon)
+        list(self.changes(rand, grid, 10))
+        before = self.checks(grid)
+        mark = grid.mark()
+        fork = grid.fork()
+        list(self.changes(rand, grid, 10))
+        assert self.checks(fork) == before == self.recomputed_checks(fork)
+        grid.undo(mark)
+        assert self.checks(grid) == before
+
+    def test_fast_and_slow_feasibility_agree(self):
+        rand = random.Random(2)
+        for i in range(10):
+            grid = Grid(7, 7, self.lexicon)
+            for change in self.changes(rand, grid, 30):
+                for span in rand.sample(sorted(grid.all_spans), 20):
+                    if (len(span) < 2 or
+                            not grid.span_not_on_blacked_out(span)):
+                        continue
+                    assert (grid.span_is_feasible(span, self.lexicon) ==
+                            grid.span_is_feasible(span, self.other_lexicon))
+                    word = ''.join(grid[sq].letter or rand.choice('aeiost')
+                                   for sq in span)
+                    assert (grid.placement_is_feasible(word, span,
+                                                       self.lexicon) ==
+                            grid.placement_is_feasible(word, span,
+                                                       self.other_lexicon))
+
+
+@pytest.mark.skipif(crosswordnik.np is None, reason='NumPy is not installed')
+class TestOpenSpans(object):
+    def test_numpy_and_python_spans_agree(self):
+        rand = random.Random(3)
+        for i in range(100):
+            grid = random_grid(rand, rand.randint(2, 9), rand.randint(2, 9))
+            for max_touching in range(4):
+                assert (set(grid._open_spans_numpy(max_touching)) ==
+                        set(grid._open_spans_python(max_touching)))
+
+    def test_masks_follow_changes(self):
+        rand = random.Random(4)
+        grid = random_grid(rand, 8, 8)
+        grid._masks()
+        mark = grid.mark()
+        fork = grid.fork()
+        for sq in random_grid(rand, 8, 8):
+            if grid[sq.m, sq.n].blacked_out:
+                continue
+            if sq.blacked_out and grid[sq.m, sq.n].letter is None:
+                grid.blackout_square(sq.m, sq.n)
+            elif sq.letter is not None:
+                grid.set_letter(sq.m, sq.n, sq.letter)
+        for g in (grid, fork):
+            letters, blacked_out = g._masks()
+            assert [[bool(x) for x in row] for row in letters] == [
+                [sq.letter is not None for sq in row] for row in g.grid]
+            assert [[bool(x) for x in row] for row in blacked_out] == [
+                [sq.blacked_out for sq in row] for row in g.grid]
+        grid.undo(mark)
+        assert (grid._masks()[0] == fork._masks()[0]).all()
+        assert (grid._masks()[1] == fork._masks()[1]).all()
+
+
+class TestLetterStats(object):
+    def setup(self):
+        self.stats = LetterStats.from_words(WORDS)
+
+    def crossings(self, grid, m, n, direction, letter):
+        """Count the words of WORDS that fit across (m, n) the slow way."""
+        dm, dn = (0, 1) if direction == 'ACROSS' else (1, 0)
+
+        def cell(i):
+            mm, nn = m + i * dm, n + i * dn
+            if not grid.are_valid_coordinates(mm, nn):
+                return '#'
+            if i == 0:
+                return letter
+            return '#' if grid[mm, nn].blacked_out else grid[mm, nn].letter
+
+        count = 0
+        for word in WORDS:
+            for start in range(1 - len(word), 1):
+                if (cell(start - 1) in ('#', None) and
+                        cell(start + len(word)) in ('#', None) and
+                        all(cell(start + i) in (None, c)
+                            for i, c in enumerate(word))):
+                    count += 1
+        return count
+
+    def test_crossing_counts(self):
+        rand = random.Random(0)
+        for i in range(30):
+            grid = random_grid(rand, 6, 7)
+            for sq in grid:
+                if sq.letter is not None or sq.blacked_out:
+                    continue
+                for direction in ('ACROSS', 'DOWN'):
+                    letter = rand.choice('aesty')
+                    assert (self.stats.crossing_count(grid, sq.m, sq.n,
+                                                      direction, letter) ==
+                            self.crossings(grid, sq.m, sq.n, direction,
+                                           letter))
+
+    def test_ranking_avoids_dead_ends(self):
+        """The most common word leaves crossings nothing fits; the fillability
+        ranking picks a word every crossing can be filled through."""
+        puzzle = CrosswordPuzzle(3, 3, wordnik=ListWordnik(),
+                                 letter_stats=self.stats)
+        for n, letter in enumerate('ton'):
+            puzzle.grid.set_letter(2, n, letter)
+        span = [(0, 0), (0, 1), (0, 2)]
+        words = puzzle.search_words('???')
+
+        def crossings_fill(word):
+            return all(self.crossings(puzzle.grid, 0, n, 'DOWN', letter)
+                       for n, letter in enumerate(word))
+
+        by_count = max(words, key=lambda word: word['count'])
+        by_fillability = max(words,
+                             key=lambda word: puzzle.rank_word(word, span))
+        assert not crossings_fill(by_count['wordstring'])
+        assert crossings_fill(by_fillability['wordstring'])
+
+    def test_file_round_trip(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'words.stats')
+            self.stats.save(path)
+            stats = LetterStats.load(path)
+            assert stats.counts == self.stats.counts
+            assert stats.words == self.stats.words
+            assert stats.pattern_count('?e?') == len(
+                [word for word in WORDS if re.match('^.e.$', word)])
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestPuzzleStock(object):
+    def setup(self):
+        self.now = 1000.0
+        self.key = (5, 5, None)
+        self.stock = PuzzleStock({self.key: 3, (7, 7, None): 1})
+
+    def test_failed_key_backs_off(self, monkeypatch):
+        monkeypatch.setattr(puzzlepool.time, 'time', lambda: self.now)
+        assert sorted(self.stock.claim(10)) == [self.key] * 3 + [(7, 7, None)]
+        for i in range(3):
+            self.stock.add((self.key, None, 'error'))
+        assert self.stock.claim(10) == []
+        entry = self.stock.stats()['stock'][0]
+        assert entry['failures'] == 3
+        assert entry['retry_in'] == puzzlepool.RETRY_DELAY * 4
+
+        # Once the delay is over, one puzzle is tried at a time.
+        self.now += puzzlepool.RETRY_DELAY * 4
+        assert self.stock.claim(10) == [self.key]
+        assert self.stock.claim(10) == []
+        self.stock.add((self.key, None, 'error'))
+        self.now += puzzlepool.RETRY_DELAY * 8 - 1
+        assert self.stock.claim(10) == []
+        self.now += 1
+        assert self.stock.claim(10) == [self.key]
+
+        self.stock.add((self.key, '{}', None))
+        assert self.stock.stats()['stock'][0]['failures'] == 0
+        assert self.stock.claim(10) == [self.key] * 2
+
+    def test_delay_is_capped(self, monkeypatch):
+        monkeypatch.setattr(puzzlepool.time, 'time', lambda: self.now)
+        for i in range(30):
+            self.stock.claim(10)
+            self.stock.add((self.key, None, 'error'))
+        assert (self.stock.stats()['stock'][0]['retry_in'] ==
+                puzzlepool.MAX_RETRY_DELAY)
+
+
+class TestPuzzleDaemon(object):
+    def setup(self):
+        self.key = (6, 6, None)
+        self.daemon = puzzlepool.PuzzleDaemon({self.key: 2}, ('127.0.0.1', 0),
+                                              processes=1,
+                                              wordnik=ListWordnik())
+        self.address = self.daemon.server_address
+        thread = threading.Thread(target=self.daemon.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def teardown(self):
+        self.daemon.shutdown()
+        self.daemon.server_close()
+
+    def test_puzzles_are_served_over_the_socket(self):
+        deadline = time.time() + 60
+        puzzle = None
+        while puzzle is None and time.time() < deadline:
+            puzzle = puzzlepool.get_puzzle(6, 6, address=self.address)
+            time.sleep(0.05)
+        assert puzzle is not None
+        assert puzzle['dimensions'] == {'width': 6, 'height': 6}
+        stats = puzzlepool.get_stats(self.address)
+        assert stats['served'] == 1
+        assert [(entry['rows'], entry['columns'], entry['target'])
+                for entry in stats['stock']] == [(6, 6, 2)]
+
+    def test_unknown_sizes_get_nothing(self):
+        assert puzzlepool.get_puzzle(9, 9, 'easy', self.address) is None
+        assert puzzlepool.get_stats(self.address)['misses'] == 1
+
+    def test_bad_requests_are_errors(self):
+        try:
+            puzzlepool._request('FROB', self.address)
+        except ValueError:
+            pass
+        else:
+            assert False, 'ValueError was not raised.'
+
+
+class TestRegions(object):
+    def test_region_built_grid_holds_only_words(self):
+        validator = WordValidator.from_words(WORDS)
+        puzzle = make_large_puzzle(20, 20, region_size=10, processes=2,
+                                   wordnik=ListWordnik(), validator=validator)
+        assert len(puzzle.clues) > 10
+        assert validator.audit_puzzle(puzzle) == []
+
+
+class TestTemplates(object):
+    def test_black_squares_are_realistic(self):
+        # 5x5 is enumerated exhaustively and 15x15 sampled.
+        for side in (5, 15):
+            size = side * side
+            found = templates.generate_templates(side, side, 20, seed=0)
+            assert found
+            for template in found:
+                assert templates.is_valid(template.cells, side, side)
+                assert (size * templates.MIN_BLACK_RATIO <=
+                        template.num_black <=
+                        size * templates.MAX_BLACK_RATIO)
+
+
+class _ErrorHandler(SocketServer.StreamRequestHandler):
+    """Answers every request with an error, like a server of another
+    protocol would."""
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            self.wfile.write('ERROR what?\n')
+            self.wfile.flush()
+
+
+class TestWordnikCache(object):
+    def setup(self):
+        self.fetches = []
+        self.timeouts = []
+        self.servers = []
+
+    def teardown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def serve(self, server):
+        self.servers.append(server)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server.server_address
+
+    def wordnik(self, address, timeout):
+        wordnik = Wordnik('key', timeout=timeout, cache=CacheClient(address))
+
+        def fetch(request_uri, additional_headers, format_, method='GET',
+                  timeout=None):
+            self.fetches.append(request_uri % format_)
+            self.timeouts.append(timeout)
+            return '{"word": "cat"}'
+
+        wordnik._fetch = fetch
+        return wordnik
+
+    def test_responses_are_cached(self):
+        address = self.serve(CacheServer(('127.0.0.1', 0), LookupCache()))
+        for i in range(2):
+            wordnik = self.wordnik(address, 5)
+            assert wordnik.word('cat') == {'word': 'cat'}
+        assert self.fetches == ['/api/word.json/cat']
+
+    def test_hung_server_is_bypassed(self):
+        # Connections are queued but nothing ever answers them.
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        try:
+            wordnik = self.wordnik(listener.getsockname(), 0.2)
+            start = time.time()
+            assert wordnik.word('cat') == {'word': 'cat'}
+            assert time.time() - start < 2
+            assert self.fetches == ['/api/word.json/cat']
+            # The direct fetch only gets what the cache left of the timeout.
+            assert 0 < self.timeouts[0] <= 0.1
+        finally:
+            listener.close()
+
+    def test_protocol_errors_are_bypassed(self):
+        server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0),
+                                                 _ErrorHandler)
+        server.daemon_threads = True
+        wordnik = self.wordnik(self.serve(server), 5)
+        assert wordnik.word('cat') == {'word': 'cat'}
+        assert wordnik.word('cat') == {'word': 'cat'}
+        assert len(self.fetches) == 2
+
+
+class TestLookupCache(object):
+    def test_concurrent_misses_fetch_once(self):
+        cache = LookupCache()
+        assert cache.get('key') is None
+        values = []
+        waiter = threading.Thread(target=lambda: values.append(
+            cache.get('key')))
+        waiter.start()
+        deadline = time.time() + 10
+        while cache.stats()['waits'] == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        cache.put('key', 'value')
+        waiter.join(10)
+        assert values == ['value']
+        stats = cache.stats()
+        assert (stats['misses'], stats['hits'], stats['waits']) == (1, 1, 1)
+
+    def test_release_lets_a_waiter_fetch(self):
+        cache = LookupCache()
+        assert cache.get('key') is None
+        values = []
+        waiter = threading.Thread(target=lambda: values.append(
+            cache.get('key')))
+        waiter.start()
+        cache.release('key')
+        waiter.join(10)
+        assert values == [None]
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LookupCache(max_bytes=10)
+        cache.put('a', 'aaaa')
+        cache.put('b', 'bbbb')
+        assert cache.get('a') == 'aaaa'
+        cache.put('c', 'cccc')
+        assert cache.stats()['evictions'] == 1
+        assert cache.get('a') == 'aaaa'
+        assert cache.get('c') == 'cccc'
+        assert cache.get('b') is None
+        cache.release('b')
+        assert cache.stats()['bytes'] <= 10
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'wordnik.cache')
+            cache = LookupCache(path=path)
+            cache.put('/api/word.json/cat', '{"word": "cat"}')
+            cache.put('/api/word.json/empty', '')
+            cache.put('/api/word.json/lines', 'two\nlines')
+            cache.save()
+            loaded = LookupCache(path=path)
+            assert loaded.entries == cache.entries
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestCacheAddress(object):
+    def test_addresses(self):
+        assert parse_address('localhost:7338') == ('localhost', 7338)
+        assert parse_address('/tmp/wordnik.sock') == '/tmp/wordnik.sock'
+
+    def test_puzzles_ask_the_cache(self):
+        puzzle = CrosswordPuzzle(5, 5, 'key', cache_address='/tmp/w.sock')
+        assert puzzle.wordnik.cache.address == '/tmp/w.sock'
+
+
+def _puz_checksum(data, checksum=0):
+    """Return the checksum described by the .puz format documentation.
+
+    This is written independently of export._checksum so each checks the other.
+    """
+    for c in data:
+        checksum = (checksum >> 1) | ((checksum & 1) << 15)
+        checksum = (checksum + ord(c)) & 0xffff
+    return checksum
+
+
+class TestExport(object):
+    def setup(self):
+        self.puzzle = make_offline_puzzle()
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_puz_checksums(self):
+        data = export.to_puz(self.puzzle, 'Title', 'Author', '(c)', 'Notes')
+        width, height, num_clues = struct.unpack_from('<BBH', data, 0x2c)
+        assert (height, width) == (self.puzzle.grid.num_rows,
+                                   self.puzzle.grid.num_columns)
+        size = width * height
+        solution = data[0x34:0x34 + size]
+        fill = data[0x34 + size:0x34 + 2 * size]
+        strings = data[0x34 + 2 * size:].split('\0')
+        title, author, copyright = strings[:3]
+        clues = strings[3:3 + num_clues]
+        notes = strings[3 + num_clues]
+        assert (title, author, copyright, notes) == ('Title', 'Author', '(c)',
+                                                      'Notes')
+
+        letters = ''.join((sq.letter or '.').upper()
+                          for sq in self.puzzle.grid)
+        assert solution == letters
+
+        cib = _puz_checksum(data[0x2c:0x34])
+        text = 0
+        for s in (title, author, copyright):
+            text = _puz_checksum(s + '\0', text)
+        for clue in clues:
+            text = _puz_checksum(clue, text)
+        text = _puz_checksum(notes + '\0', text)
+        overall = _puz_checksum(fill, _puz_checksum(solution, cib))
+        for s in (title, author, copyright):
+            overall = _puz_checksum(s + '\0', overall)
+        for clue in clues:
+            overall = _puz_checksum(clue, overall)
+        overall = _puz_checksum(notes + '\0', overall)
+
+        assert struct.unpack_from('<H', data, 0)[0] == overall
+        assert struct.unpack_from('<H', data, 0x0e)[0] == cib
+        parts = (cib, _puz_checksum(solution), _puz_checksum(fill), text)
+        masked = ''.join(chr(ord(c) ^ (x & 0xff))
+                         for c, x in zip('ICHE', parts))
+        masked += ''.join(chr(ord(c) ^ (x >> 8))
+                          for c, x in zip('ATED', parts))
+        assert data[0x10:0x18] == masked
+
+    def test_export_writes_while_the_generator_runs(self):
+        path = os.path.join(self.directory, 'puzzles')
+        seen = []
+
+        def puzzles():
+            for i in range(5):
+                if i:
+                    seen.append(len(os.listdir(path)))
+                yield self.puzzle
+
+        assert export.export_puzzles(puzzles(), path) == 5
+        assert seen == [1, 2, 3, 4]
+        assert len(os.listdir(path)) == 5
+
+    def test_export_to_zip(self):
+        path = os.path.join(self.directory, 'puzzles.zip')
+        assert export.export_puzzles([self.puzzle] * 3, path, 'ipuz') == 3
+        names = zipfile.ZipFile(path).namelist()
+        assert names == ['puzzle%06d.ipuz' % i for i in (1, 2, 3)]
+
+    def test_export_nothing(self):
+        path = os.path.join(self.directory, 'empty')
+        assert export.export_puzzles(iter([]), path) == 0
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""
+Checks that every run of letters on a grid is a word, without calling Wordnik.
+
+Placing a word can create words nobody chose. Two parallel words that overlap
+leave runs of letters down the columns they share, like "td" here:
+
+    cat
+      dog
+
+A WordValidator checks such runs against a local set of words. Before a word is
+placed, check_placement rescans only the row and columns (or column and rows)
+the new letters are in and returns the runs through them that aren't words.
+audit checks a whole grid, e.g. one made before validation was used.
+
+>>> validator = WordValidator.from_words(open('words.txt'))
+>>> validator.check_placement(puzzle.grid, 'dog', [(1, 2), (1, 3), (1, 4)])
+[(((0, 2), (1, 2)), 'td')]
+>>> puzzle = CrosswordPuzzle(15, 15, validator=validator)
+"""
+
+
+from lexicon import normalize
+
+
+class WordValidator(object):
+    """Checks runs of letters against a set of words."""
+
+    def __init__(self, words):
+        """`words` is anything supporting `in`, e.g. a set or Lexicon.
+
+        A set should hold lowercase words.
+        """
+        self.words = words
+
+    @classmethod
+    def from_words(cls, words):
+        """Return a validator for the iterable `words`, held in a set."""
+        return cls(frozenset(filter(None, (normalize(w) for w in words))))
+
+    def is_word(self, run):
+        return run.lower() in self.words
+
+    @staticmethod
+    def _line(grid, m, n, direction):
+        """Return the (m, n) of every square in the row or column of (m, n)."""
+        if direction == 'ACROSS':
+            return [(m, j) for j in range(grid.num_columns)]
+        return [(i, n) for i in range(grid.num_rows)]
+
+    @staticmethod
+    def _runs(grid, line, overlay):
+        """Yield (squares, letters) for each run of 2+ letters in `line`."""
+        run = []
+        for sq in line + [None]:
+            letter = None
+            if sq is not None:
+                letter = overlay[sq] if sq in overlay else grid[sq].letter
+            if letter is not None:
+                run.append((sq, letter))
+                continue
+            if len(run) > 1:
+                yield (tuple(sq for sq, _ in run),
+                       ''.join(letter for _, letter in run))
+            run = []
+
+    def check_placement(self, grid, word, span):
+        """Return the non-word runs placing `word` on `span` would create.
+
+        Only runs containing at least one of the new letters are checked, and
+        the run that is `word` itself is taken to be a word. A run along the
+        span that is longer than `word` is returned even if it's a word, since
+        the clue would be stored for `word` alone. An empty list means the
+        placement is fine.
+        """
+        direction = grid.get_span_direction(span)
+        cross = 'DOWN' if direction == 'ACROSS' else 'ACROSS'
+        new = dict((sq, letter) for sq, letter in zip(span, word)
+                   if grid[sq].letter is None)
+        if not new:
+            return []
+
+        lines = [self._line(grid, span[0][0], span[0][1], direction)]
+        lines.extend(self._line(grid, m, n, cross) for (m, n) in new)
+
+        bad = []
+        for line in lines:
+            for squares, letters in self._runs(grid, line, new):
+                if squares == tuple(span):
+                    continue
+                if any(sq in new for sq in squares) and (
+                        not self.is_word(letters) or
+                        set(span).issubset(squares)):
+                    bad.append((squares, letters))
+        return bad
+
+    def audit(self, grid, allowed=()):
+        """Return (squares, letters) for every run on `grid` that isn't a word.
+
+        Runs in `allowed`, e.g. the words of a puzzle's clues, are accepted
+        even if they aren't in the validator's words.
+        """
+        allowed = set(word.lower() for word in allowed)
+        lines = [self._line(grid, m, 0, 'ACROSS')
+                 for m in range(grid.num_rows)]
+        lines.extend(self._line(grid, 0, n, 'DOWN')
+                     for n in range(grid.num_columns))
+        return [(squares, letters)
+                for line in lines
+                for squares, letters in self._runs(grid, line, {})
+                if letters.lower() not in allowed and not self.is_word(letters)]
+
+    def audit_puzzle(self, puzzle):
+        """Return the non-word runs of a CrosswordPuzzle's grid."""
+        return self.audit(puzzle.grid,
+                          [word for word, _ in puzzle.clues.values()])
@@ -11,11 +11,15 @@ This module currently presents a thin wrapper around the wordnik API.
 import sys
 import simplejson as json
 import httplib
+import socket
+import time
 import urllib
 from optparse import OptionParser
 from xml.etree import ElementTree
 from pprint import pprint
 
+from wordnikcache import CacheProtocolError
+
 
 class RestfulError(Exception):
     pass
@@ -44,9 +48,14 @@ class Wordnik(object):
     FORMAT_JSON = "json"
     FORMAT_XML = "xml"
 
-    def __init__(self, api_key, default_format=FORMAT_JSON):
+    def __init__(self, api_key, default_format=FORMAT_JSON, timeout=None,
+                 cache=None):
         self.api_key = api_key
         self.default_format = default_format
+        # Seconds to wait on the server before socket.timeout is raised.
+        self.timeout = timeout
+        # A wordnikcache.CacheClient shared with other processes, or None.
+        self.cache = cache
         self.formatters = {
                Wordnik.FORMAT_JSON: json.loads,
                Wordnik.FORMAT_XML: ElementTree.fromstring
@@ -62,29 +71,89 @@ class Wordnik(object):
         return path
 
     def _get(self, request_uri, additional_headers=None, format_=None):
-        """ make a GET request to the wordnik server """
-        return self._make_request(request_uri, additional_headers, format_)
+        """ make a GET request to the wordnik server, or the cache if set
+
+        Only successful responses are cached. If the cache server can't be
+        reached, is too slow or answers nonsense, the request goes straight
+        to wordnik. The cache and wordnik together get no longer than
+        self.timeout, and the cache at most half of it so that a hung cache
+        server leaves time to fetch directly.
+        """
+        format_ = format_ or self.default_format
+        if self.cache is None or additional_headers is not None:
+            return self._make_request(request_uri, additional_headers,
+                                      format_)
+        key = request_uri % format_
+        start = time.time()
+        try:
+            body = self.cache.get(key, self.timeout and self.timeout / 2.0)
+        except (socket.error, CacheProtocolError):
+            return self._make_request(request_uri, additional_headers,
+                                      format_,
+                                      timeout=self._time_left(start))
+        if body is None:
+            try:
+                body = self._fetch(request_uri, additional_headers, format_,
+                                   timeout=self._time_left(start))
+            except:
+                self._cache_call(self.cache.release, key)
+                raise
+            self._cache_call(self.cache.put, key, body)
+        return self.formatters[format_](body)
+
+    def _time_left(self, start):
+        """Return what's left of self.timeout since `start`, None if no limit.
+
+        Raise socket.timeout if nothing is left.
+        """
+        if self.timeout is None:
+            return None
+        left = self.timeout - (time.time() - start)
+        if left <= 0:
+            raise socket.timeout('The request timed out.')
+        return left
+
+    def _cache_call(self, method, *args):
+        try:
+            method(*args, timeout=self.timeout)
+        except (socket.error, CacheProtocolError):
+            pass
 
     def _make_request(self, request_uri, additional_headers=None, format_=None, 
-                      method="GET"):
+                      method="GET", timeout=None):
         """ make a request to the wordnik server """
-
         format_ = format_ or self.default_format
-        con = httplib.HTTPConnection(BASE_HOST)
+        body = self._fetch(request_uri, additional_headers, format_, method,
+                           timeout)
+        return self.formatters[format_](body)
+
+    def _fetch(self, request_uri, additional_headers, format_, method="GET",
+               timeout=None):
+        """ make a request and return the body of a successful response
+
+        `timeout` overrides self.timeout for this request.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if timeout is None:
+            con = httplib.HTTPConnection(BASE_HOST)
+        else:
+            con = httplib.HTTPConnection(BASE_HOST, timeout=timeout)
         headers = {"api_key": self.api_key}
         if additional_headers is not None:
             headers.update(additional_headers)
         con.request(method, request_uri % format_, headers=headers)
         result = con.getresponse()
 
-        retval = self.formatters[format_](result.read())
+        body = result.read()
         if result.status != httplib.OK:
+            retval = self.formatters[format_](body)
             try:
                 raise RestfulError(retval["message"])
             except (TypeError, ), error:
                 raise RestfulError(retval.find("message").text)
 
-        return retval 
+        return body
 
     def api_usage(self, format_=None):
         """Return information about the user's API key usage."""
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+
+"""
+A cache of Wordnik responses shared by every generator process on a host.
+
+Each Wordnik client normally fetches everything itself, so N generator
+processes use up the API quota N times as fast. Instead they can all ask one
+CacheServer first by giving their Wordnik clients a CacheClient:
+
+    python wordnikcache.py --socket /tmp/wordnik.sock --max-mb 256 \\
+        --persist wordnik.cache
+
+>>> wordnik = Wordnik(api_key, cache=CacheClient('/tmp/wordnik.sock'))
+
+If several workers miss the same key at once, only the first is told to fetch
+it; the others wait until it has been stored and then get a hit. Memory is
+bounded by evicting the least recently used responses, and the cache can be
+written to disk so it survives restarts.
+
+The protocol is line based and simple enough to try out with netcat. Keys are
+URL quoted request URIs, so they never contain whitespace:
+
+    GET <key>                  ->  HIT <length>, then <length> bytes
+                                   or MISS, after which the client must PUT
+                                   or RELEASE the key
+    PUT <key> <length>, then <length> bytes  ->  OK
+    RELEASE <key>              ->  OK
+    STATS                      ->  OK <JSON of the hit rate etc.>
+"""
+
+
+from collections import OrderedDict
+from optparse import OptionParser
+import os
+import socket
+import SocketServer
+import sys
+import threading
+import urllib
+
+import simplejson as json
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# How long a GET waits for another client's fetch before fetching itself.
+LEASE_TIMEOUT = 30
+
+# How long a client waits for the server's response by default. It's shorter
+# than LEASE_TIMEOUT, so a client gives up waiting on another client's fetch
+# and fetches itself sooner than the server would tell it to.
+DEFAULT_CLIENT_TIMEOUT = 10
+
+
+class CacheProtocolError(Exception):
+    """Raised when the cache server or client gets a malformed message."""
+
+
+class LookupCache(object):
+    """A thread safe LRU cache of strings with leases on missing keys.
+
+    A lease marks a key that a client has been told to fetch. Other clients
+    asking for the key wait for the lease to end instead of fetching it too.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, path=None):
+        """If `path` is given the cache is loaded from and saved to it."""
+        self.max_bytes = max_bytes
+        self.path = path
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.leases = {}  # key -> threading.Event set when the lease ends
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def get(self, key):
+        """Return the value of `key`, or None after granting a lease on it."""
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    value = self.entries.pop(key)
+                    self.entries[key] = value
+                    self.hits += 1
+                    return value
+                lease = self.leases.get(key)
+                if lease is None:
+                    self.leases[key] = threading.Event()
+                    self.misses += 1
+                    return None
+                self.waits += 1
+            if not lease.wait(LEASE_TIMEOUT):
+                # The lease holder is stuck, so let this client try instead.
+                self.release(key, lease)
+
+    def put(self, key, value):
+        """Store `value` for `key` and end any lease on it."""
+        with self.lock:
+            if key in self.entries:
+                self.num_bytes -= len(self.entries.pop(key))
+            if len(value) <= self.max_bytes:
+                self.entries[key] = value
+                self.num_bytes += len(value)
+            while self.num_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.num_bytes -= len(evicted)
+                self.evictions += 1
+            self._end_lease(key)
+
+    def release(self, key, lease=None):
+        """End the lease on `key` without storing anything.
+
+        If `lease` is given, only that lease is ended.
+        """
+        with self.lock:
+            if lease is None or self.leases.get(key) is lease:
+                self._end_lease(key)
+
+    def _end_lease(self, key):
+        lease = self.leases.pop(key, None)
+        if lease is not None:
+            lease.set()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.num_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / float(lookups) if lookups else 0.0,
+            }
+
+    def load(self):
+        """Read the entries saved in self.path, oldest first."""
+        with open(self.path, 'rb') as f:
+            for line in iter(f.readline, ''):
+                key, length = line.split()
+                value = f.read(int(length))
+                self.put(key, value)
+
+    def save(self):
+        """Write the entries to self.path, oldest first."""
+        with self.lock:
+            items = list(self.entries.items())
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as f:
+            for key, value in items:
+                f.write('%s %d\n' % (key, len(value)))
+                f.write(value)
+        os.rename(temporary, self.path)
+
+
+class _CacheRequestHandler(SocketServer.StreamRequestHandler):
+    """Speaks the cache protocol for one client connection."""
+
+    def handle(self):
+        cache = self.server.cache
+        leased = set()
+        try:
+            for line in iter(self.rfile.readline, ''):
+                words = line.split()
+                command = words[0].upper() if words else ''
+                if command == 'GET' and len(words) == 2:
+                    value = cache.get(words[1])
+                    if value is None:
+                        leased.add(words[1])
+                        self._send('MISS')
+                    else:
+                        self._send('HIT %d' % len(value), value)
+                elif command == 'PUT' and len(words) == 3:
+                    value = self.rfile.read(int(words[2]))
+                    cache.put(words[1], value)
+                    leased.discard(words[1])
+                    self._send('OK')
+                elif command == 'RELEASE' and len(words) == 2:
+                    cache.release(words[1])
+                    leased.discard(words[1])
+                    self._send('OK')
+                elif command == 'STATS' and len(words) == 1:
+                    self._send('OK ' + json.dumps(cache.stats()))
+                else:
+                    self._send('ERROR unknown request')
+        finally:
+            # Don't leave other clients waiting on a client that went away.
+            for key in leased:
+                cache.release(key)
+
+    def _send(self, line, payload=''):
+        self.wfile.write(line + '\n' + payload)
+        self.wfile.flush()
+
+
+class CacheServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """Serves a LookupCache over localhost TCP."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, cache):
+        SocketServer.TCPServer.__init__(self, address, _CacheRequestHandler)
+        self.cache = cache
+
+
+class UnixCacheServer(SocketServer.ThreadingMixIn,
+                      SocketServer.UnixStreamServer):
+    """Serves a LookupCache over a Unix socket."""
+
+    daemon_threads = True
+
+    def __init__(self, path, cache):
+        if os.path.exists(path):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path,
+                                               _CacheRequestHandler)
+        self.cache = cache
+
+
+def parse_address(value):
+    """Return the address of a cache server given as "host:port" or a path.
+    """
+    host, _, port = value.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return value
+
+
+class CacheClient(object):
+    """A connection to a cache server, for use by wordnik.Wordnik.
+
+    `address` is the path of a Unix socket or a (host, port) pair. A client
+    keeps one connection open and must not be shared between threads.
+    Requests taking more than `timeout` seconds raise socket.timeout.
+    """
+
+    def __init__(self, address, timeout=DEFAULT_CLIENT_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        self._socket = None
+        self._file = None
+
+    def _connect(self, timeout):
+        if self._socket is None:
+            if isinstance(self.address, basestring):
+                con = socket.socket(socket.AF_UNIX)
+                con.settimeout(timeout)
+                con.connect(self.address)
+            else:
+                con = socket.create_connection(self.address, timeout)
+            self._socket, self._file = con, con.makefile('rb')
+        self._socket.settimeout(timeout)
+
+    def close(self):
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+            self._socket = self._file = None
+
+    def _timeout(self, timeout):
+        """Return the lower of `timeout` and self.timeout. None is no limit."""
+        if timeout is None or self.timeout is None:
+            return self.timeout if timeout is None else timeout
+        return min(timeout, self.timeout)
+
+    def _request(self, line, payload='', timeout=None):
+        """Send a request. Return the words of the response line and the line.
+
+        For a HIT the value that follows is returned instead of the line.
+        Connection errors and timeouts close the connection and are raised as
+        socket.error so that callers can fall back to fetching directly.
+        Malformed responses also close it, as it can't be told where the next
+        response starts, and raise CacheProtocolError.
+        """
+        try:
+            self._connect(self._timeout(timeout))
+            self._socket.sendall(line + '\n' + payload)
+            response = self._file.readline()
+            if not response:
+                raise socket.error('The cache server closed the connection.')
+            words = response.split()
+            if not words or words[0] == 'ERROR':
+                raise CacheProtocolError(response.strip())
+            if words[0] == 'HIT':
+                if len(words) != 2 or not words[1].isdigit():
+                    raise CacheProtocolError(response.strip())
+                value = self._file.read(int(words[1]))
+                if len(value) != int(words[1]):
+                    raise socket.error('The cache server closed the '
+                                       'connection.')
+                return words, value
+        except (socket.error, CacheProtocolError):
+            self.close()
+            raise
+        return words, response
+
+    @staticmethod
+    def _quote(key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return urllib.quote(key, safe='/?&=.,:*%')
+
+    def get(self, key, timeout=None):
+        """Return the cached value of `key` or None if the caller must fetch.
+
+        After None is returned the caller must call put or release. `timeout`
+        lowers self.timeout for this request.
+        """
+        words, value = self._request('GET ' + self._quote(key),
+                                     timeout=timeout)
+        if words[0] == 'MISS':
+            return None
+        elif words[0] != 'HIT':
+            self.close()
+            raise CacheProtocolError(value.strip())
+        return value
+
+    def put(self, key, value, timeout=None):
+        self._request('PUT %s %d' % (self._quote(key), len(value)), value,
+                      timeout)
+
+    def release(self, key, timeout=None):
+        self._request('RELEASE ' + self._quote(key), timeout=timeout)
+
+    def stats(self):
+        _, response = self._request('STATS')
+        return json.loads(response.split(' ', 1)[1])
+
+
+def main(args):
+    parser = OptionParser()
+    parser.add_option('-s', '--socket', dest='socket',
+                      help='listen on this Unix socket')
+    parser.add_option('-p', '--port', dest='port', type='int',
+                      help='listen on this localhost port')
+    parser.add_option('-m', '--max-mb', dest='max_mb', type='int',
+                      default=DEFAULT_MAX_BYTES // (1024 * 1024))
+    parser.add_option('--persist', dest='path',
+                      help='load the cache from and save it to this file')
+    options, args = parser.parse_args(args)
+    if (options.socket is None) == (options.port is None):
+        parser.error('Exactly one of --socket and --port must be given.')
+
+    cache = LookupCache(options.max_mb * 1024 * 1024, options.path)
+    if options.socket is not None:
+        server = UnixCacheServer(options.socket, cache)
+    else:
+        server = CacheServer(('127.0.0.1', options.port), cache)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if cache.path is not None:
+            cache.save()
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))